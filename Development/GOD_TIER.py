@@ -1,75 +1,216 @@
 #!/usr/local/bin/python3
 
 import sys
-import qrcode
-import fpdf
-import subprocess
 import os
-import tempfile
+import logging
+from collections import deque
+from label_cache import LabelCache, cache_key
+from qr_matrix import qr_matrix, qr_cache_summary, qr_cache_hit_rate
+from label_layout import SheetLayout, SHEET_SIZES, SHEET_MARGIN, SHEET_GUTTER
+from label_formats import LABEL_FORMATS, find_format
+from spooler import Spooler
+from printer_backends import open_backend
+from label_metrics import Metrics, NullMetrics, METRICS_SAMPLE_EVERY
+from label_output import run_directory, label_file_name, batch_file_name, write_atomic, write_unique
+from label_watch import TsvWatch
+from label_rows import read_tsv, clean_field
+from label_index import select_rows, parse_row_ranges
+from label_journal import open_journal, NullJournal, JOURNAL_SUFFIX
+from label_raster import RAW_LANGUAGES, RAW_OPTIONS, RASTER_VERSION, render_raw
 
-help_message = "Usage: make_label.py -s SERIAL -p PROJECT -d DEVELOPMENT_PHASE -c config OR make_label.py --file FILE_PATH"
+logging.basicConfig(filename='labels.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+help_message = "Usage: make_label.py [--format NAME] -s SERIAL -p PROJECT -d DEVELOPMENT_PHASE -c config OR make_label.py --file FILE_PATH [--workers N] [--backend auto|cups|lpr|file:DIR] [--metrics-sample N] [--sheet letter|a4 [--margin MM] [--gutter MM]] [--raw dymo|zpl] [--rows 1200-1300,1405] [--serial SERIAL[,SERIAL...]] [--resume] OR make_label.py --watch TSV_OR_DIRECTORY"
+
+PRINTER = "DYMO_LabelWriter_550_Turbo"
+
+# --sheet runs go to a sheet printer instead; None means the system default printer
+SHEET_PRINTER = None
+SHEET_MEDIA = {'letter': 'Letter', 'a4': 'A4'}
+
+# Sheets laid out as pages of one PDF and sent as one print job
+SHEETS_PER_JOB = 10
+
+# Each run writes its labels into a new directory under here
+LABEL_ROOT = os.path.expanduser("~/Desktop")
+
+# Single labels (-s/-p/-d/-c) all go into this one folder instead of a new run directory
+# each, under a name of their own, and are removed again once they have been spooled
+SINGLE_LABEL_DIRECTORY = os.path.join(LABEL_ROOT, "labels_single")
+
+# Columns a label needs, in the order rows are handed back
+TSV_COLUMNS = ('project', 'phase', 'config', 'serial')
+
+# Bump whenever the render code changes so cached PDFs are not reprinted; editing a format in
+# label_formats.json changes its layout_id, which does the same for that format
+LAYOUT_VERSION = 2
 
-def scaled(n):
-    scaler = 1.3
-    return n * scaler
 def get_label_format():
     user_input = input("Are you printing a label for an Apple Watch? (y/n): ").strip().lower()
     if user_input == 'y':
         # Format for Apple Watch
-        return (28, 28)
+        return 'dymo-28x28'
     else:
         # Default format
-        return (54, 25)
+        return 'dymo-54x25'
 
 def make_qr(serial):
-    serial_qr_file = "/tmp/qr_serial.png"
-    img = qrcode.make(serial)
-    img.save(serial_qr_file)
-    return serial_qr_file
-
-def make_label(serial, project, phase, config, qr_file, label_format):
-    file_name = f"{project} - {serial}.pdf"
-    pdf = fpdf.FPDF(format=label_format)
-    pdf.add_page()
-    pdf.image(
-        qr_file, 
-        x=scaled(0),
-        y=scaled(0),
-        w=scaled(13),
-        h=scaled(13),
-    )
-    pdf.set_font('Helvetica', 'B', scaled(12))
-    pdf.text(x=scaled(13), y=scaled(5), txt=project)
-    pdf.set_font('Helvetica', '', scaled(8))
-    pdf.text(x=scaled(13), y=scaled(8), txt=f"{phase}")
-    pdf.text(x=scaled(13), y=scaled(11), txt=f"{serial}")
-    pdf.text(x=scaled(2), y=scaled(14), txt=f"{config}")
-    pdf.output(file_name, "F")
-    return file_name
-
-def print_labels(file_name, label_format):
-    media_size = "Custom.1x1inch" if label_format == (28, 28) else "Custom.25x54mm"
-    subprocess.run([
-        "lpr", 
-        "-P", "DYMO_LabelWriter_550_Turbo", 
-        "-o", "orientation-requested=4", 
-        "-o", f"media={media_size}", 
-        file_name
-    ])
+    # Encoded once per distinct payload and shared through the QR matrix cache
+    return qr_matrix(serial)
+
+def add_label(pdf, serial, project, phase, config, qr, label_format='dymo-54x25'):
+    fields = {'serial': serial, 'project': project, 'phase': phase, 'config': config}
+    LABEL_FORMATS[label_format].render(pdf, fields, qr)
+
+def single_label_directory():
+    os.makedirs(SINGLE_LABEL_DIRECTORY, exist_ok=True)
+    return SINGLE_LABEL_DIRECTORY
+
+def make_label(serial, project, phase, config, qr, label_format, directory=None):
+    # Without a directory the label is a single one: a unique file in SINGLE_LABEL_DIRECTORY
+    # that the caller removes once it has been spooled
+    name = label_file_name(project, serial, config)
+    pdf = LABEL_FORMATS[label_format].new_pdf()
+    add_label(pdf, serial, project, phase, config, qr, label_format)
+    if directory is None:
+        return write_unique(single_label_directory(), name, bytes(pdf.output()))
+    return write_atomic(os.path.join(directory, name), bytes(pdf.output()))
+
+def render_label(row, label_format, metrics=NullMetrics(), raw=None):
+    # Runs in a worker process: encode the QR, lay out the label and return the PDF bytes,
+    # or with raw set the printer's own raster job (see label_raster.py)
+    project, phase, config, serial = row
+    with metrics.timed('qr'):
+        qr = make_qr(serial)
+    if raw:
+        with metrics.timed('layout'):
+            fields = {'serial': serial, 'project': project, 'phase': phase, 'config': config}
+            return render_raw(LABEL_FORMATS[label_format], fields, qr, raw)
+    with metrics.timed('layout'):
+        pdf = LABEL_FORMATS[label_format].new_pdf()
+        add_label(pdf, serial, project, phase, config, qr, label_format)
+    with metrics.timed('write'):
+        return bytes(pdf.output())
+
+def render_label_or_error(row, label_format, raw=None):
+    # Pool entry point: (pdf_bytes, None), or (None, message) when the row can't be drawn. fpdf's
+    # errors (e.g. a character outside Latin-1) can't be unpickled in this process, and one that
+    # fails to come back breaks the pool for every row after it
+    try:
+        return render_label(row, label_format, raw=raw), None
+    except Exception as e:
+        return None, str(e)
+
+def layout_key(label_format, raw=None):
+    # Raw jobs are cached apart from the PDFs of the same layout
+    layout_id = LABEL_FORMATS[label_format].layout_id
+    return f"{layout_id}/{raw}{RASTER_VERSION}" if raw else layout_id
+
+def cached_label(row, label_format, cache, metrics=NullMetrics(), raw=None):
+    # PDF bytes for a row, straight from the label cache when it was printed before
+    key = cache_key(row, layout_key(label_format, raw), LAYOUT_VERSION)
+    pdf_bytes = cache.get(key)
+    if pdf_bytes is None:
+        pdf_bytes = render_label(row, label_format, metrics, raw)
+        cache.put(key, pdf_bytes)
+    return pdf_bytes
+
+def render_sheets(rows, layout, metrics=NullMetrics()):
+    # Impose rows onto as many sheets as they need, as pages of one PDF
+    pdf = layout.new_pdf()
+    for start in range(0, len(rows), layout.per_sheet):
+        labels = []
+        for project, phase, config, serial in rows[start:start + layout.per_sheet]:
+            with metrics.timed('qr'):
+                qr = make_qr(serial)
+            labels.append(({'serial': serial, 'project': project, 'phase': phase, 'config': config}, qr))
+        with metrics.timed('layout'):
+            layout.render(pdf, labels)
+    with metrics.timed('write'):
+        return bytes(pdf.output())
+
+def cached_sheets(rows, label_format, layout, cache, metrics=NullMetrics()):
+    # Same as cached_label, for a whole print job of sheets
+    fields = [layout.sheet, layout.margin, layout.gutter] + [field for row in rows for field in row]
+    key = cache_key(fields, LABEL_FORMATS[label_format].layout_id, LAYOUT_VERSION)
+    pdf_bytes = cache.get(key)
+    if pdf_bytes is None:
+        pdf_bytes = render_sheets(rows, layout, metrics)
+        cache.put(key, pdf_bytes)
+    return pdf_bytes
+
+def write_label(directory, row_number, row, pdf_bytes, raw=None):
+    # Named by row number so the same serial with different configs can't overwrite itself
+    project, phase, config, serial = row
+    extension = RAW_LANGUAGES[raw].extension if raw else ".pdf"
+    return write_atomic(os.path.join(directory, label_file_name(project, serial, config, row_number, extension)), pdf_bytes)
+
+def ordered_results(pool, rows, label_format, window, cache, raw=None):
+    # Keep at most `window` rows in flight and hand back (row_number, row, key, future) in TSV row order,
+    # each future giving (pdf_bytes, error); cached rows get an already finished future instead of a trip
+    # to the pool
+    from concurrent.futures import Future
+    pending = deque()
+    layout_id = layout_key(label_format, raw)
+    for row_number, row in rows:
+        key = cache_key(row, layout_id, LAYOUT_VERSION)
+        pdf_bytes = cache.get(key)
+        if pdf_bytes is None:
+            future = pool.submit(render_label_or_error, row, label_format, raw=raw)
+        else:
+            future = Future()
+            future.set_result((pdf_bytes, None))
+        pending.append((row_number, row, key, future))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+# Stream label rows from a TSV file, matching columns by header name
+def read_rows(filepath):
+    return read_tsv(filepath, TSV_COLUMNS)
+
+def numbered_rows(filepath, row_ranges=(), serials=()):
+    # (row_number, row) for the whole file, or for just the chosen rows through the TSV's
+    # index, numbered as in a full run so reprinted labels keep their file names
+    if row_ranges or serials:
+        return select_rows(filepath, TSV_COLUMNS, row_ranges, serials)
+    return enumerate(read_rows(filepath), start=1)
+
+def open_printer(label_format, backend="auto", raw=None):
+    # Media and orientation are set once for the whole session, not per job; raw jobs
+    # already are the printer's raster and go through CUPS untouched
+    options = dict(RAW_OPTIONS) if raw else LABEL_FORMATS[label_format].printer_options()
+    return open_backend(backend, PRINTER, options)
+
+def open_sheet_printer(sheet, backend="auto"):
+    return open_backend(backend, SHEET_PRINTER, {"media": SHEET_MEDIA[sheet]})
 
 def main(argv):
     import getopt
     try:
-        opts, args = getopt.getopt(argv, "hs:p:d:c:", ["file="])
+        opts, args = getopt.getopt(argv, "hs:p:d:c:", ["file=", "workers=", "backend=", "metrics-sample=", "watch=", "sheet=", "margin=", "gutter=", "format=", "raw=", "rows=", "serial=", "resume"])
     except getopt.GetoptError:
         print(help_message)
         exit(1)
 
     file_path = None
+    watch_path = None
     serial = None
     project = None
     phase = ""
     config = ""
+    workers = 1
+    backend = "auto"
+    metrics_sample = METRICS_SAMPLE_EVERY
+    label_format = None
+    sheet = None
+    margin = SHEET_MARGIN
+    gutter = SHEET_GUTTER
+    raw = None
+    row_ranges = []
+    serials = []
+    resume = False
 
     for opt, arg in opts:
         if opt == '-h':
@@ -77,6 +218,44 @@ def main(argv):
             exit(0)
         elif opt == "--file":
             file_path = arg
+        elif opt == "--watch":
+            watch_path = arg
+        elif opt == "--workers":
+            workers = int(arg)
+        elif opt == "--backend":
+            backend = arg
+        elif opt == "--metrics-sample":
+            metrics_sample = int(arg)
+        elif opt == "--format":
+            try:
+                label_format = find_format(arg).name
+            except ValueError as e:
+                print(e)
+                exit(1)
+        elif opt == "--sheet":
+            sheet = arg.lower()
+            if sheet not in SHEET_SIZES:
+                print(f"Unknown sheet size {arg}, expected one of: {', '.join(SHEET_SIZES)}")
+                exit(1)
+        elif opt == "--margin":
+            margin = float(arg)
+        elif opt == "--gutter":
+            gutter = float(arg)
+        elif opt == "--raw":
+            raw = arg.lower()
+            if raw not in RAW_LANGUAGES:
+                print(f"Unknown raw printer language {arg}, expected one of: {', '.join(RAW_LANGUAGES)}")
+                exit(1)
+        elif opt == "--rows":
+            try:
+                row_ranges += parse_row_ranges(arg)
+            except ValueError as e:
+                print(e)
+                exit(1)
+        elif opt == "--serial":
+            serials += [s.strip() for s in arg.split(",") if s.strip()]
+        elif opt == "--resume":
+            resume = True
         elif opt in ("-s"):
             serial = arg
         elif opt in ("-p"):
@@ -86,41 +265,215 @@ def main(argv):
         elif opt in ("-c"):
             config = arg
 
-    label_format = get_label_format()
+    if (row_ranges or serials) and not file_path:
+        print("--rows and --serial pick rows out of a --file TSV")
+        exit(1)
+
+    if resume and (row_ranges or serials or not file_path):
+        print("--resume carries on an interrupted --file run; it can't be combined with --rows or --serial")
+        exit(1)
+
+    if sheet and raw:
+        print("--raw sends single labels to a label printer; it can't be combined with --sheet")
+        exit(1)
+
+    if label_format is None:
+        label_format = get_label_format()
 
-    if file_path:
-        process_file(file_path, label_format)
+    if watch_path:
+        watch_rows(watch_path, label_format, backend, raw)
+    elif file_path:
+        layout = SheetLayout(LABEL_FORMATS[label_format].template, sheet, margin, gutter) if sheet else None
+        process_file(file_path, label_format, workers, backend, metrics_sample, layout, raw, row_ranges, serials, resume)
     else:
         if not serial or not project:
             print(help_message)
             exit(1)
         
         serial = serial.strip()
-        project = project.strip().replace('/', '_')
-        phase = phase.strip().replace('/', '_')
-        config = config.strip().replace('/', '_')
+        project = clean_field(project)
+        phase = clean_field(phase)
+        config = clean_field(config)
 
-        qr_file = make_qr(serial)
-        file = make_label(serial, project, phase, config, qr_file, label_format)
+        row = (project, phase, config, serial)
+        name = label_file_name(project, serial, config, extension=RAW_LANGUAGES[raw].extension if raw else ".pdf")
+        file = write_unique(single_label_directory(), name, cached_label(row, label_format, LabelCache(), raw=raw))
         print(file)
-        print_labels(file, label_format)
+        printer = open_printer(label_format, backend, raw)
+        try:
+            printer.submit(file, name)
+        finally:
+            printer.close()
+            os.remove(file)  # the print system has its own copy once submit returns
 
-def process_file(file_path, label_format):
+def run_journal(file_path, label_format, layout=None, raw=None, resume=False):
+    # Full runs are journalled next to the TSV so --resume can pick up after the last printed row
+    run = {"format": label_format, "raw": raw, "sheet": [layout.sheet, layout.margin, layout.gutter] if layout else None}
+    try:
+        return open_journal(file_path + JOURNAL_SUFFIX, run, resume)
+    except ValueError as e:
+        print(e)
+        exit(1)
+
+def unfinished_rows(rows, journal):
+    # Rows an earlier run of this journal hasn't printed
+    for row_number, row in rows:
+        if not journal.done(row_number, row):
+            yield row_number, row
+
+def skip_row(row_number, row, error, journal):
+    # A row that can't be drawn (e.g. a character outside Latin-1) is journalled as failed and
+    # the run goes on without it; --resume tries it again instead of stopping there
+    logging.error(f"Row {row_number} ({' '.join(row)}) failed: {error}")
+    print(f"Row {row_number} ({' '.join(row)}) failed: {error}")
+    journal.record_failed(row_number, row, error)
+
+def process_file(file_path, label_format, workers=1, backend="auto", metrics_sample=METRICS_SAMPLE_EVERY, layout=None, raw=None, row_ranges=(), serials=(), resume=False):
     if not os.path.exists(file_path):
         print(f"File {file_path} not found!")
         exit(1)
-    
-    label_directory = tempfile.mkdtemp(prefix="labels_", dir=os.path.expanduser("~/Desktop"))
+
+    # Reprints of a few rows leave the full run's journal alone
+    journal = NullJournal() if row_ranges or serials else run_journal(file_path, label_format, layout, raw, resume)
+    if journal.directory and os.path.isdir(journal.directory):
+        label_directory = journal.directory  # resumed: the rest of the labels join the ones already there
+    else:
+        label_directory = run_directory(LABEL_ROOT)
+    journal.start(label_directory)
     print(f"Label directory: {label_directory}")
 
-    with open(file_path, 'r') as f:
-        lines = f.readlines()[1:]
+    cache = LabelCache()
+    metrics = Metrics('GOD_TIER', sample_every=metrics_sample)
+    metrics.watch('label_cache_hit_rate', cache.hit_rate)
+    if workers == 1:
+        metrics.watch('qr_cache_hit_rate', qr_cache_hit_rate)  # the workers' caches aren't visible from here
+    printer = open_sheet_printer(layout.sheet, backend) if layout else open_printer(label_format, backend, raw)
+    try:
+        with Spooler(printer) as spooler:
+            metrics.watch('queue_depth', spooler.pending)
+            rows = unfinished_rows(metrics.rows_from(numbered_rows(file_path, row_ranges, serials)), journal)
+            if layout:
+                print(f"{layout.columns} x {layout.rows} labels per {layout.sheet} sheet")
+                process_rows_sheets(rows, label_format, layout, cache, label_directory, spooler, metrics, journal)
+            elif workers > 1:
+                process_rows_parallel(rows, label_format, workers, cache, label_directory, spooler, metrics, raw, journal)
+            else:
+                for row_number, row in rows:
+                    try:
+                        pdf_bytes = cached_label(row, label_format, cache, metrics, raw)
+                    except Exception as e:
+                        skip_row(row_number, row, e, journal)
+                        continue
+                    with metrics.timed('spool', row_number):
+                        file_name = write_label(label_directory, row_number, row, pdf_bytes, raw)
+                        journal.record_rendered(row_number, row, file_name)
+                        spooler.submit(file_name, journal.marker([(row_number, row)]))
+                    print(file_name)
+    finally:
+        journal.close()  # after the spooler, so every job it sent is in the journal
+    metrics.close()
+    if journal.skipped:
+        print(f"Resumed: skipped {journal.skipped} rows that were already printed")
+    if spooler.failed:
+        print(f"{len(spooler.failed)} labels could not be printed: {', '.join(spooler.failed)}")
+    print(f"Label cache: {cache.hits} hits, {cache.misses} misses")
+    if workers == 1:
+        print(qr_cache_summary())
+
+def watch_rows(path, label_format, backend="auto", raw=None):
+    # Print rows as they are appended to a TSV (or to any TSV in a directory), carrying on
+    # after the last label printed by a previous run; stop with Ctrl-C
+    if not os.path.exists(path):
+        print(f"{path} not found!")
+        exit(1)
+
+    label_directory = run_directory(LABEL_ROOT)
+    print(f"Label directory: {label_directory}")
+
+    import signal
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # kill / a service manager stops it like Ctrl-C
+
+    cache = LabelCache()
+    watch = TsvWatch(path, TSV_COLUMNS)
+    labels = 0
+    with Spooler(open_printer(label_format, backend, raw)) as spooler:
+        try:
+            for file_path, row_number, row, mark in watch.rows():
+                labels += 1
+                file_name = write_label(label_directory, labels, row, cached_label(row, label_format, cache, raw=raw), raw)
+                spooler.submit(file_name, mark)  # the checkpoint moves once the label has been sent
+                print(file_name)
+        except KeyboardInterrupt:
+            print("Stopping, waiting for queued labels to print...")
+    watch.close()
+
+def process_rows_sheets(rows, label_format, layout, cache, directory, spooler, metrics, journal=NullJournal()):
+    # Lay rows out N-up, SHEETS_PER_JOB sheets to a print job; runs in this process
+    # since a sheet is already many labels' worth of work per PDF
+    labels_per_job = layout.per_sheet * SHEETS_PER_JOB
+    batch = []
+    for row_number, row in rows:
+        batch.append((row_number, row))
+        if len(batch) == labels_per_job:
+            spool_sheets(batch, label_format, layout, cache, directory, spooler, metrics, journal)
+            batch = []
+    if batch:
+        spool_sheets(batch, label_format, layout, cache, directory, spooler, metrics, journal)
+
+def spool_sheets(batch, label_format, layout, cache, directory, spooler, metrics, journal=NullJournal()):
+    # batch is (row_number, row) pairs
+    try:
+        pdf_bytes = cached_sheets([row for _, row in batch], label_format, layout, cache, metrics)
+    except Exception:
+        # Find the rows that can't be drawn on their own and print the rest without them
+        printable = []
+        for row_number, row in batch:
+            try:
+                render_sheets([row], layout)
+            except Exception as e:
+                skip_row(row_number, row, e, journal)
+            else:
+                printable.append((row_number, row))
+        if len(printable) == len(batch):
+            raise  # not down to any one row
+        if printable:
+            spool_sheets(printable, label_format, layout, cache, directory, spooler, metrics, journal)
+        return
+    first_row, last_row = batch[0][0], batch[-1][0]
+    with metrics.timed('spool', first_row):
+        file_name = write_atomic(os.path.join(directory, batch_file_name(first_row, last_row)), pdf_bytes)
+        for row_number, row in batch:
+            journal.record_rendered(row_number, row, file_name)
+        spooler.submit(file_name, journal.marker(batch))
+    print(file_name)
 
-    for line in lines:
-        project, phase, config, serial = line.strip().split('\t')
-        file_name = make_label(serial, project, phase, config, make_qr(serial), label_format)
-        print(file_name)
-        print_labels(file_name, label_format)
+def process_rows_parallel(rows, label_format, workers, cache, directory, spooler, metrics, raw=None, journal=NullJournal()):
+    # Render on a process pool; writing and spooling stay here so jobs reach lpr in row order.
+    # QR, layout and write happen in the workers, so here they show up as one 'render' wait.
+    from concurrent.futures import ProcessPoolExecutor
+    failures = 0
+    labels = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = ordered_results(pool, rows, label_format, workers * 4, cache, raw)
+        for row_number, row, key, future in results:
+            labels += 1
+            try:
+                with metrics.timed('render', row_number):
+                    pdf_bytes, error = future.result()
+            except Exception as e:  # the worker process itself died
+                pdf_bytes, error = None, str(e)
+            if error:
+                failures += 1
+                skip_row(row_number, row, error, journal)
+                continue
+            cache.put(key, pdf_bytes)
+            with metrics.timed('spool', row_number):
+                file_name = write_label(directory, row_number, row, pdf_bytes, raw)
+                journal.record_rendered(row_number, row, file_name)
+                spooler.submit(file_name, journal.marker([(row_number, row)]))
+            print(file_name)
+    if failures:
+        print(f"{failures} of {labels} labels failed.")
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -1,64 +1,42 @@
 #!/usr/local/bin/python3
-import sys, logging, subprocess
+import os, sys, logging
 from tkinter import Tk, Label, Button, filedialog, messagebox
-import qrcode
-import fpdf
+from label_job import LabelJob, ProgressPanel
+from label_output import run_directory, label_file_name, write_atomic
+from label_rows import read_tsv
+from qr_matrix import qr_matrix
+import label_batch
+from label_formats import LABEL_FORMATS
 
 # Logging setup
 logging.basicConfig(filename='labels.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Constants
-LABEL_FORMAT = (89,28)
-SCALER = 1.3
+LABEL_FORMAT = LABEL_FORMATS['himmy-89x28']  # geometry, fonts and media are in label_formats.json
+PAGES_PER_JOB = label_batch.PAGES_PER_JOB  # labels per PDF document / lpr job
 
-def scaled(n):
-    return n * SCALER
+# Columns a label needs, in the order rows are handed back
+TSV_COLUMNS = ('serial', 'project', 'phase', 'config')
 
 def make_qr(serial):
-    serial_qr_file = "/tmp/qr_serial.png"
-    img = qrcode.make(serial)
-    img.save(serial_qr_file)
-    return serial_qr_file
+    # Encoded once per distinct payload and shared through the QR matrix cache
+    return qr_matrix(serial)
 
-# Assuming scaled is a function you've defined to scale measurements
-def scaled(value):
-    return value  # Replace this with your scaling function or formula
+def new_label_pdf():
+    return LABEL_FORMAT.new_pdf()
 
-# Constants for label size
-LABEL_WIDTH = 89  # label width in mm (4 inches)
-LABEL_HEIGHT = 28  # label height in mm (3 inches)
-LABEL_FORMAT = (LABEL_WIDTH, LABEL_HEIGHT)
+def add_label(pdf, serial, project, phase, config, qr):
+    LABEL_FORMAT.render(pdf, {'serial': serial, 'project': project, 'phase': phase, 'config': config}, qr)
 
-def make_qr(serial):
-    serial_qr_file = "/tmp/qr_serial.png"
-    img = qrcode.make(serial)
-    img.save(serial_qr_file)
-    return serial_qr_file
-
-def make_label(serial, project, phase, config, qr_file):
-    file_name = f"{project} - {serial}.pdf"
-    qr_size = scaled(15)
-    project_font_size = scaled(9)
-    other_font_size = scaled(7)
-
-    pdf = fpdf.FPDF(orientation='L', unit='mm', format=LABEL_FORMAT)
-    pdf.add_page()
-
-    qr_x_center = (LABEL_FORMAT[0] - qr_size) / 2
-    qr_y_center = (LABEL_FORMAT[1] - qr_size) / 2 - 31
-
-    pdf.image(qr_file, x=qr_x_center, y=qr_y_center, w=qr_size, h=qr_size)
-
-    text_start_x = qr_x_center + qr_size + 2
-    text_y_start = qr_y_center + 6
-
-    pdf.set_font('Arial', 'B', project_font_size)
-    pdf.text(x=text_start_x, y=text_y_start, txt=f"{serial}")
+def make_label(serial, project, phase, config, qr, directory=None):
+    file_name = os.path.join(directory or run_directory(), label_file_name(project, serial, config))
+    pdf = new_label_pdf()
+    add_label(pdf, serial, project, phase, config, qr)
+    return write_atomic(file_name, bytes(pdf.output()))
 
-    pdf.set_font('Arial', '', other_font_size)
-    pdf.text(x=text_start_x, y=text_y_start + 3, txt=f"{config}")
-    pdf.text(x=text_start_x, y=text_y_start + 6, txt=f"{project}")
-    pdf.text(x=text_start_x, y=text_y_start + 9, txt=f"{phase}")
+# Stream label rows from a TSV file, matching columns by header name ('/' in project, phase and config becomes '_')
+def read_rows(filepath):
+    return read_tsv(filepath, TSV_COLUMNS, clean=True)
 
 
 class LabelApp:
@@ -78,6 +56,9 @@ class LabelApp:
         self.generate_btn = Button(self.master, text="Generate Labels", command=self.generate_labels)
         self.generate_btn.pack(pady=20)
 
+        self.progress = ProgressPanel(self.master)
+        self.progress.pack(pady=10)
+
     def browse_files(self):
         filename = filedialog.askopenfilename(initialdir="/", title="Select a TSV File", filetypes=(("TSV files", "*.tsv"), ("All files", "*.*")))
         if filename:
@@ -93,28 +74,37 @@ class LabelApp:
             messagebox.showerror("Error", "Please select a valid TSV file.")
             return
 
-        try:
-            with open(filepath, 'r') as f:
-                lines = f.readlines()
-                for line in lines[1:]:
-                    serial, project, phase, config = line.strip().split('\t')
-                    serial = serial.strip()
-                    project = project.strip().replace('/', '_')
-                    phase = phase.strip().replace('/', '_')
-                    config = config.strip().replace('/', '_')
-
-                    logging.info(f"Generating label for Serial: {serial}, Project: {project}, Phase: {phase}, Config: {config}")
-                    qr_file = make_qr(serial)
-                    label_file = make_label(serial, project, phase, config, qr_file)
-
-                    logging.info(f"Sending {label_file} to printer...")
-                    subprocess.run(["lpr", label_file])
-
+        # The batch runs on a worker thread; the panel polls it and calls back here when it ends
+        self.set_running(True)
+        self.progress.run(LabelJob(self.run_labels, filepath), self.labels_done, self.labels_failed)
+
+    def run_labels(self, job, filepath):
+        # Worker thread: returns (labels printed, whether it was cancelled). Printing starts
+        # right away; the progress bar gets its total once the line count is done.
+        job.count_in_background(filepath)
+        printed = label_batch.print_batch(read_rows(filepath), LABEL_FORMAT, 'HIMMY_BUTLER', PAGES_PER_JOB,
+                                          progress=job.progress, cancelled=job.cancelled)
+        return printed, job.cancelled.is_set()
+
+    def labels_done(self, result):
+        printed, cancelled = result
+        self.set_running(False)
+        if cancelled:
+            logging.info(f"Stopped after {printed} labels.")
+            messagebox.showinfo("Cancelled", f"Stopped after {printed} labels.")
+        else:
             logging.info("All labels generated successfully.")
             messagebox.showinfo("Success", "Labels generated successfully!")
-        except Exception as e:
-            logging.error(f"An error occurred: {e}")
-            messagebox.showerror("Error", f"An error occurred: {e}")
+
+    def labels_failed(self, e):
+        self.set_running(False)
+        logging.error(f"An error occurred: {e}")
+        messagebox.showerror("Error", f"An error occurred: {e}")
+
+    def set_running(self, running):
+        state = 'disabled' if running else 'normal'
+        self.browse_btn.config(state=state)
+        self.generate_btn.config(state=state)
 
 if __name__ == "__main__":
     logging.info("Script started.")
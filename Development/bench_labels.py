@@ -0,0 +1,298 @@
+#!/usr/local/bin/python3
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import statistics
+import platform
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+
+# Benchmark for the label pipeline: parse -> QR encode -> PDF layout -> PDF write -> spool,
+# timed per row for every label format over synthetic TSVs. Each (format, rows) case runs in
+# its own process so caches and peak RSS don't leak between cases. Output is JSON, e.g.
+#   ./bench_labels.py --rows 10,1000 --output before.json
+# and diff it against a run on another commit.
+#   ./bench_labels.py --startup
+# times the single-label CLI instead (-h, first label, reprint from the label cache),
+# each as a fresh interpreter, i.e. what someone at a label station waits for.
+#   ./bench_labels.py --memory --rows 100000
+# measures the ingest stage alone: memory held per row once rows are kept (a batch,
+# a sheet) and the peak while streaming through them.
+#   ./bench_labels.py --raw dymo
+# times the raw printer bitmap path instead of the PDF: layout is compositing the
+# bitmap, write is encoding the printer job.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+FORMATS = ["iphone-80x89", "watch-25x25", "dymo-54x25", "himmy-89x28"]
+ROW_COUNTS = [10, 1000, 100000]
+STAGES = ["parse", "qr", "layout", "write", "spool"]
+STARTUP_REPEAT = 5
+LABEL_ARGS = ["-s", "D94", "-p", "P1 NED", "-d", "1N12C", "-c", "M0GC7W9JVT"]
+
+
+class NullBackend:
+    # Stub printer backend: accepts every job without sending it anywhere
+    name = "null"
+
+    def submit(self, file_name, title=None):
+        return None
+
+    def close(self):
+        pass
+
+
+def label_format_driver(name):
+    # (module, new_pdf(), add(pdf, serial, project, phase, config, qr)) for a format
+    if name in ("iphone-80x89", "watch-25x25"):
+        import final_script as module
+        product_type = 'iPhone' if name == "iphone-80x89" else 'Apple Watch'
+        return (module,
+                lambda: module.new_label_pdf(product_type),
+                lambda pdf, *row: module.add_label(pdf, *row, product_type))
+    if name == "dymo-54x25":
+        import GOD_TIER as module
+        return (module,
+                lambda: module.LABEL_FORMATS['dymo-54x25'].new_pdf(),
+                lambda pdf, *row: module.add_label(pdf, *row, 'dymo-54x25'))
+    if name == "himmy-89x28":
+        import HIMMY_BUTLER as module
+        return module, module.new_label_pdf, module.add_label
+    raise ValueError(f"Unknown label format: {name}")
+
+
+def write_tsv(path, rows, columns):
+    # Synthetic export: unique serials, with projects, phases and configs repeating like a real build
+    rng = random.Random(rows)
+    projects = [f"P{i} NED" for i in range(1, 4)]
+    phases = [f"1N{i}C" for i in range(10, 16)]
+    configs = ["".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(10)) for _ in range(50)]
+    with open(path, "w") as f:
+        f.write("\t".join(columns) + "\n")
+        for i in range(rows):
+            fields = {"serial": f"D{i:07d}", "project": rng.choice(projects), "phase": rng.choice(phases), "config": rng.choice(configs)}
+            f.write("\t".join(fields[column] for column in columns) + "\n")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS reports bytes, Linux KB
+
+
+def run_case(format_name, rows, raw=None):
+    work_dir = tempfile.mkdtemp(prefix="label_bench_")
+    os.chdir(work_dir)  # the scripts log to ./labels.log
+    sys.path.insert(0, SCRIPT_DIR)
+    module, new_pdf, add = label_format_driver(format_name)
+    from spooler import Spooler
+    if raw:
+        from label_formats import LABEL_FORMATS
+        from label_raster import RAW_LANGUAGES, label_bitmap
+        label_format, language = LABEL_FORMATS[format_name], RAW_LANGUAGES[raw]
+
+    tsv_path = os.path.join(work_dir, "bench.tsv")
+    write_tsv(tsv_path, rows, module.TSV_COLUMNS)
+    out_path = os.path.join(work_dir, "label.pdf")
+    timings = {stage: [] for stage in STAGES}
+    pdf_bytes_total = 0
+    clock = time.perf_counter_ns
+
+    started = clock()
+    with Spooler(NullBackend(), max_queue=1024) as spooler:
+        reader = module.read_rows(tsv_path)
+        while True:
+            t0 = clock()
+            row = next(reader, None)
+            t1 = clock()
+            if row is None:
+                break
+            fields = dict(zip(module.TSV_COLUMNS, row))
+            qr = module.make_qr(fields["serial"])
+            t2 = clock()
+            if raw:
+                bitmap = label_bitmap(label_format, fields, qr, language.dpi)
+                t3 = clock()
+                pdf_bytes = language.encode([bitmap])
+            else:
+                pdf = new_pdf()
+                add(pdf, fields["serial"], fields["project"], fields["phase"], fields["config"], qr)
+                t3 = clock()
+                pdf_bytes = bytes(pdf.output())
+            with open(out_path, "wb") as out:
+                out.write(pdf_bytes)
+            t4 = clock()
+            spooler.submit(out_path)
+            t5 = clock()
+            pdf_bytes_total += len(pdf_bytes)
+            for stage, start, end in zip(STAGES, (t0, t1, t2, t3, t4), (t1, t2, t3, t4, t5)):
+                timings[stage].append(end - start)
+    elapsed = (clock() - started) / 1e9
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    stages = {}
+    for stage, values in timings.items():
+        total_s = sum(values) / 1e9
+        values.sort()
+        stages[stage] = {
+            "total_s": round(total_s, 6),
+            "rows_per_s": round(rows / total_s, 1) if total_s else None,
+            "p50_us": round(percentile(values, 0.50) / 1e3, 2),
+            "p99_us": round(percentile(values, 0.99) / 1e3, 2),
+        }
+    return {
+        "format": format_name,
+        "rows": rows,
+        "raw": raw,
+        "elapsed_s": round(elapsed, 6),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+        "stages": stages,
+        "peak_rss_kb": peak_rss_kb(),
+        "pdf_bytes_per_label": round(pdf_bytes_total / rows, 1) if rows else 0,
+    }
+
+
+def run_memory_case(format_name, rows):
+    work_dir = tempfile.mkdtemp(prefix="label_bench_")
+    os.chdir(work_dir)
+    sys.path.insert(0, SCRIPT_DIR)
+    module = label_format_driver(format_name)[0]
+    tsv_path = os.path.join(work_dir, "bench.tsv")
+    write_tsv(tsv_path, rows, module.TSV_COLUMNS)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for row in module.read_rows(tsv_path):
+        pass
+    stream_s = time.perf_counter() - started
+    stream_peak = tracemalloc.get_traced_memory()[1]
+
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = list(module.read_rows(tsv_path))
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "format": format_name,
+        "rows": len(kept),
+        "stream_rows_per_s": round(rows / stream_s, 1) if stream_s else None,
+        "stream_peak_kb": round(stream_peak / 1024, 1),
+        "held_bytes_per_row": round(held / rows, 1) if rows else 0,
+        "held_kb": round(held / 1024, 1),
+    }
+
+
+def startup_cases(sink):
+    # (name, script, arguments, fresh label cache for every run?)
+    god_tier = os.path.join(SCRIPT_DIR, "GOD_TIER.py")
+    og_make_label = os.path.join(SCRIPT_DIR, "OGmake_label.py")
+    return [
+        ("GOD_TIER -h", god_tier, ["-h"], True),
+        ("GOD_TIER first label", god_tier, LABEL_ARGS + ["--backend", f"file:{sink}"], True),
+        ("GOD_TIER reprint (label cache hit)", god_tier, LABEL_ARGS + ["--backend", f"file:{sink}"], False),
+        ("OGmake_label -h", og_make_label, ["-h"], True),
+        ("OGmake_label first label", og_make_label, LABEL_ARGS, True),
+    ]
+
+
+def run_startup(repeat):
+    # Wall time from launching the interpreter to the label being handed to the printer backend
+    work_dir = tempfile.mkdtemp(prefix="label_startup_")
+    results = []
+    for name, script, args, fresh_cache in startup_cases(os.path.join(work_dir, "sink")):
+        home = tempfile.mkdtemp(dir=work_dir)
+        os.makedirs(os.path.join(home, "Desktop"))
+        env = dict(os.environ, HOME=home)
+        if not fresh_cache:
+            # Print it once so every timed run is a reprint
+            subprocess.run([sys.executable, script] + args, cwd=home, env=env, input="n\n", capture_output=True, text=True)
+        times = []
+        for _ in range(repeat):
+            if fresh_cache:
+                shutil.rmtree(os.path.join(home, ".cache"), ignore_errors=True)
+            started = time.perf_counter()
+            child = subprocess.run([sys.executable, script] + args, cwd=home, env=env, input="n\n", capture_output=True, text=True)
+            times.append((time.perf_counter() - started) * 1000)
+            if child.returncode != 0:
+                print(child.stdout, child.stderr, file=sys.stderr)
+                sys.exit(child.returncode)
+        results.append({"case": name, "runs": repeat, "min_ms": round(min(times), 1), "median_ms": round(statistics.median(times), 1)})
+        print(f"{name}: {results[-1]['median_ms']} ms", file=sys.stderr)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import fpdf
+        fpdf_version = fpdf.FPDF_VERSION
+    except ImportError:
+        fpdf_version = None
+    return {"commit": commit, "python": platform.python_version(), "fpdf": fpdf_version, "platform": platform.platform()}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the label pipeline per stage.")
+    parser.add_argument("--formats", default=",".join(FORMATS), help=f"Comma separated, from: {', '.join(FORMATS)}")
+    parser.add_argument("--rows", default=",".join(map(str, ROW_COUNTS)), help="Comma separated synthetic TSV sizes.")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    parser.add_argument("--startup", action="store_true", help="Time the single-label CLI from a cold interpreter instead.")
+    parser.add_argument("--repeat", type=int, default=STARTUP_REPEAT, help="Runs per --startup case.")
+    parser.add_argument("--memory", action="store_true", help="Measure memory of the ingest stage only.")
+    parser.add_argument("--raw", choices=["dymo", "zpl"], help="Time the raw printer bitmap path instead of the PDF.")
+    parser.add_argument("--case", nargs=2, metavar=("FORMAT", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        # Child process: run one case and print its result
+        if args.memory:
+            print(json.dumps(run_memory_case(args.case[0], int(args.case[1]))))
+        else:
+            print(json.dumps(run_case(args.case[0], int(args.case[1]), args.raw)))
+        return
+
+    if args.startup:
+        write_report({"environment": environment(), "startup": run_startup(args.repeat)}, args.output)
+        return
+
+    results = []
+    for format_name in args.formats.split(","):
+        for rows in args.rows.split(","):
+            print(f"{format_name} x {rows} rows...", file=sys.stderr)
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", format_name, rows] + (["--memory"] if args.memory else []) + (["--raw", args.raw] if args.raw else []),
+                                   capture_output=True, text=True)
+            if child.returncode != 0:
+                print(child.stderr, file=sys.stderr)
+                sys.exit(child.returncode)
+            results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    write_report({"environment": environment(), "results": results}, args.output)
+
+
+def write_report(report, output=None):
+    report = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
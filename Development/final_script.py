@@ -1,93 +1,59 @@
 #!/usr/local/bin/python3
 
-import sys, getopt, logging, subprocess
+import os, sys, getopt, logging, importlib.util
 from tkinter import Tk, Label, Button, filedialog, messagebox, Radiobutton, StringVar
+from label_job import LabelJob, ProgressPanel
+from label_output import run_directory, label_file_name, write_atomic
+from label_rows import read_tsv
 
 # Set up the logging configuration
 logging.basicConfig(filename='labels.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-try:
-    import qrcode
-    import fpdf
-except ImportError:
+# Check the packages are installed without importing them; they load on the first label
+if not all(importlib.util.find_spec(name) for name in ('qrcode', 'fpdf')):
     logging.error("Required modules not found.")
     print("Requires the following packages:")
     print('python3 -m pip install qrcode fpdf')
     sys.exit(1)
 
-# Scaling function for different label formats
-def scaled(size, label_format):
-    # Assuming some scaling function exists based on label format
-    base_format = (80, 89)  # base format for scaling reference
-    scale_factor = min(label_format[0] / base_format[0], label_format[1] / base_format[1])
-    return size * scale_factor
+from qr_matrix import qr_matrix
+import label_batch
+from label_formats import LABEL_FORMATS
 
 # Function to create QR code image file
 def make_qr(serial):
-    serial_qr_file = "/tmp/qr_serial.png"
-    img = qrcode.make(serial)
-    img.save(serial_qr_file)
-    return serial_qr_file
-
-# Function to generate PDF label
-import fpdf
-
-def make_label(serial, project, phase, config, qr_file, product_type='iPhone'):
-    file_name = f"{project} - {serial}.pdf"
-
-    # Define label formats for different products
-    iphone_label_format = (80, 89)
-    watch_label_format = (25, 25)
-
-    # Set parameters based on product type
-    if product_type == 'iPhone':
-        label_format = iphone_label_format
-        qr_size = scaled(23, label_format)
-        project_font_size = scaled(13, label_format)
-        other_font_size = scaled(10, label_format)
-        orientation = 'L'  # Landscape for iPhone label
-    else:  # Default to Apple Watch
-        label_format = watch_label_format
-        qr_size = 13  # Fixed size due to smaller label
-        project_font_size = 7  # Smaller font size for the project text
-        other_font_size = 5  # Smaller font size for the other text elements
-        orientation = 'P'  # Portrait for Watch label
-
-    pdf = fpdf.FPDF(orientation=orientation, unit='mm', format=label_format)
-    pdf.add_page()
-
-    if product_type == 'iPhone':
-        # iPhone label generation code
-        qr_x_center = (label_format[0] - qr_size) / 2 - 24
-        qr_y_center = (label_format[1] - qr_size) / 2 + 14
-        pdf.rotate(90, qr_x_center, qr_y_center)
-        pdf.image(qr_file, x=qr_x_center, y=qr_y_center, w=qr_size, h=qr_size)
-        pdf.rotate(0)  # Reset rotation for text
-        text_start_x = qr_y_center + qr_size - 57
-        text_y_start = qr_x_center + 17
-        pdf.rotate(90, text_start_x, text_y_start)
-        pdf.set_font('Arial', 'B', project_font_size)
-        pdf.text(x=text_start_x, y=text_y_start - 3, txt=serial)
-        pdf.set_font('Arial', '', other_font_size)
-        pdf.text(x=text_start_x, y=text_y_start + 2, txt=config)
-        pdf.text(x=text_start_x, y=text_y_start + 6, txt=phase)
-        pdf.text(x=text_start_x, y=text_y_start + 10, txt=project)
-        pdf.rotate(0)  # Reset rotation for final output
-    else:
-        # Apple Watch label generation code
-        qr_x = (label_format[0] - qr_size) / 2
-        qr_y = -1
-        pdf.image(qr_file, x=qr_x, y=qr_y, w=qr_size, h=qr_size)
-        text_y_start = qr_y + qr_size + 1.5  # Adjust text start position below QR code
-        pdf.set_font('Arial', 'B', project_font_size)
-        pdf.text(2, text_y_start, f" {serial}")
-        pdf.set_font('Arial', '', other_font_size)
-        pdf.text(2, text_y_start + 3, f"{config}")
-        pdf.text(2, text_y_start + 6, f"{phase}")
-        pdf.text(2, text_y_start + 9, project)
-
-    pdf.output(file_name, "F")
-    return file_name
+    # Encoded once per distinct payload and shared through the QR matrix cache
+    return qr_matrix(serial)
+
+# Columns a label needs, in the order rows are handed back
+TSV_COLUMNS = ('serial', 'project', 'phase', 'config')
+
+# Number of labels laid out as pages of one PDF and sent as one lpr job
+PAGES_PER_JOB = label_batch.PAGES_PER_JOB
+
+# Label format for a product type (see label_formats.json); anything that isn't 'iPhone' gets the Watch label
+def product_format(product_type):
+    return LABEL_FORMATS['iphone-80x89' if product_type == 'iPhone' else 'watch-25x25']
+
+# Function to create an empty PDF document for a product type
+def new_label_pdf(product_type='iPhone'):
+    return product_format(product_type).new_pdf()
+
+# Function to draw one label as a new page of an existing PDF
+def add_label(pdf, serial, project, phase, config, qr, product_type='iPhone'):
+    fields = {'serial': serial, 'project': project, 'phase': phase, 'config': config}
+    product_format(product_type).render(pdf, fields, qr)
+
+# Function to generate PDF label (in a new run directory unless one is given)
+def make_label(serial, project, phase, config, qr, product_type='iPhone', directory=None):
+    file_name = os.path.join(directory or run_directory(), label_file_name(project, serial, config))
+    pdf = new_label_pdf(product_type)
+    add_label(pdf, serial, project, phase, config, qr, product_type)
+    return write_atomic(file_name, bytes(pdf.output()))
+
+# Function to stream label rows from a TSV file, matching columns by header name
+def read_rows(filepath):
+    return read_tsv(filepath, TSV_COLUMNS)
 
 
 # Function to open file dialog and select TSV file
@@ -110,44 +76,64 @@ def generate_labels():
         messagebox.showerror("Error", "Please select a valid TSV file.")
         return
 
-    try:
-        logging.info(f"Reading from file: {filepath}")
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
-            for line in lines[1:]:  # skipping header
-                serial, project, phase, config = line.strip().split('\t')
-                qr_file = make_qr(serial)
-                label_file = make_label(serial, project, phase, config, qr_file, product_type)
-
-                logging.info(f"Sending {label_file} to printer...")
-                subprocess.run(["lpr", label_file])
-
+    logging.info(f"Reading from file: {filepath}")
+    set_running(True)
+    progress_panel.run(LabelJob(run_labels, filepath, product_type), labels_done, labels_failed)
+
+# Runs on the worker thread; returns (labels printed, whether it was cancelled). The total
+# for the progress bar is counted alongside instead of holding up the first label.
+def run_labels(job, filepath, product_type):
+    job.count_in_background(filepath)
+    printed = label_batch.print_batch(read_rows(filepath), product_format(product_type), 'final_script', PAGES_PER_JOB,
+                                      progress=job.progress, cancelled=job.cancelled)
+    return printed, job.cancelled.is_set()
+
+# Called back on the Tk thread when the worker finishes
+def labels_done(result):
+    printed, cancelled = result
+    set_running(False)
+    if cancelled:
+        logging.info(f"Stopped after {printed} labels.")
+        messagebox.showinfo("Cancelled", f"Stopped after {printed} labels.")
+    else:
         logging.info("All labels generated successfully.")
         messagebox.showinfo("Success", "Labels generated successfully!")
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
-        messagebox.showerror("Error", f"An error occurred: {e}")
 
-# GUI setup
-root = Tk()
-root.title("Label Generator")
+def labels_failed(e):
+    set_running(False)
+    logging.error(f"An error occurred: {e}")
+    messagebox.showerror("Error", f"An error occurred: {e}")
+
+# Keep a second batch from being started while one is running
+def set_running(running):
+    state = 'disabled' if running else 'normal'
+    browse_button.config(state=state)
+    generate_button.config(state=state)
+
+# GUI setup (only when run as a script, so the label functions can be imported)
+if __name__ == "__main__":
+    root = Tk()
+    root.title("Label Generator")
+
+    label = Label(root, text="Select the product type for the labels:")
+    label.pack(pady=20)
 
-label = Label(root, text="Select the product type for the labels:")
-label.pack(pady=20)
+    # Radio buttons for product type selection
+    product_type_var = StringVar(value='iPhone')
+    Radiobutton(root, text="iPhone", variable=product_type_var, value='iPhone').pack()
+    Radiobutton(root, text="Apple Watch", variable=product_type_var, value='Apple Watch').pack()
 
-# Radio buttons for product type selection
-product_type_var = StringVar(value='iPhone')
-Radiobutton(root, text="iPhone", variable=product_type_var, value='iPhone').pack()
-Radiobutton(root, text="Apple Watch", variable=product_type_var, value='Apple Watch').pack()
+    file_label = Label(root, text="No file selected", fg="red")
+    file_label.pack(pady=10)
 
-file_label = Label(root, text="No file selected", fg="red")
-file_label.pack(pady=10)
+    browse_button = Button(root, text="Browse", command=browse_files)
+    browse_button.pack()
 
-browse_button = Button(root, text="Browse", command=browse_files)
-browse_button.pack()
+    generate_button = Button(root, text="Generate Labels", command=generate_labels)
+    generate_button.pack(pady=20)
 
-generate_button = Button(root, text="Generate Labels", command=generate_labels)
-generate_button.pack(pady=20)
+    progress_panel = ProgressPanel(root)
+    progress_panel.pack(pady=10)
 
-# Run the GUI loop
-root.mainloop()
+    # Run the GUI loop
+    root.mainloop()
@@ -0,0 +1,67 @@
+import os
+import logging
+from spooler import Spooler
+from printer_backends import open_backend
+from label_metrics import Metrics
+from label_output import run_directory, batch_file_name, write_atomic
+from qr_matrix import qr_matrix, qr_cache_summary, qr_cache_hit_rate
+
+# The batch pipeline behind the label GUIs (HIMMY_BUTLER.py, final_script.py): rows of
+# (serial, project, phase, config) laid out as pages of shared PDFs, PAGES_PER_JOB pages to
+# a document, and each document queued as one print job while the next chunk is laid out.
+# The scripts differ only in the LabelFormat they hand in.
+
+PAGES_PER_JOB = 100
+
+
+def render_batch(rows, label_format, metrics):
+    # One PDF for a chunk of rows. Not cached: a key over the whole chunk would only hit for
+    # the exact same rows at the same offset, never for a reprint of a few labels.
+    pdf = label_format.new_pdf()
+    for serial, project, phase, config in rows:
+        with metrics.timed('qr'):
+            qr = qr_matrix(serial)
+        with metrics.timed('layout'):
+            label_format.render(pdf, {'serial': serial, 'project': project, 'phase': phase, 'config': config}, qr)
+    with metrics.timed('write'):
+        return bytes(pdf.output())
+
+
+def spool_batch(pdf_bytes, first_row, last_row, directory, spooler, metrics):
+    # Write a finished document and queue it as a single print job
+    file_name = os.path.join(directory, batch_file_name(first_row, last_row))
+    with metrics.timed('spool', first_row):
+        write_atomic(file_name, pdf_bytes)
+        spooler.submit(file_name)
+    logging.info(f"Queued {file_name} ({last_row - first_row + 1} labels) for printing")
+
+
+def print_batch(rows, label_format, run, pages_per_job=PAGES_PER_JOB, progress=None, cancelled=None):
+    # run names the script in labels.log. progress(rows_read) is called per row; once
+    # cancelled (a threading.Event) is set, no more rows are read but the ones already read
+    # still print. Returns the number of rows printed; raises RuntimeError if a job failed.
+    metrics = Metrics(run)
+    metrics.watch('qr_cache_hit_rate', qr_cache_hit_rate)
+    directory = run_directory()
+    logging.info(f"Writing labels to {directory}")
+    batch = []
+    row_number = 0
+    with Spooler(open_backend(options=label_format.printer_options())) as spooler:
+        metrics.watch('queue_depth', spooler.pending)
+        for row_number, row in enumerate(metrics.rows_from(rows), start=1):
+            batch.append(row)
+            if len(batch) >= pages_per_job:
+                spool_batch(render_batch(batch, label_format, metrics), row_number - len(batch) + 1, row_number, directory, spooler, metrics)
+                batch = []
+            if progress:
+                progress(row_number)
+            if cancelled and cancelled.is_set():
+                logging.info(f"Cancelled after {row_number} rows")
+                break
+        if batch:
+            spool_batch(render_batch(batch, label_format, metrics), row_number - len(batch) + 1, row_number, directory, spooler, metrics)
+    metrics.close()
+    if spooler.failed:
+        raise RuntimeError(f"Could not print {', '.join(spooler.failed)}")
+    logging.info(qr_cache_summary())
+    return row_number
@@ -0,0 +1,105 @@
+import os
+import hashlib
+import logging
+import tempfile
+
+# On-disk cache of rendered label PDFs so reprints skip QR encoding and layout
+CACHE_DIRECTORY = os.path.expanduser("~/.cache/labels")
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Running total of the cached PDFs' sizes, kept next to them so opening the cache (once per
+# single label) doesn't stat every file in it; a full scan only happens when it is missing
+# and on eviction, which also corrects any drift from processes writing at the same time
+SIZE_FILE = "size"
+
+
+def cache_key(fields, layout_id, layout_version):
+    # Hash of everything that changes the rendered PDF; layout_id is the format's (see label_formats.py)
+    text = "\t".join(str(field) for field in fields)
+    text += f"\t{layout_id}\tv{layout_version}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LabelCache:
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.total_bytes = None  # read from SIZE_FILE on the first put
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def _stored_total(self):
+        try:
+            with open(os.path.join(self.directory, SIZE_FILE)) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return sum(size for _, _, size in self._entries())
+
+    def _store_total(self):
+        with open(os.path.join(self.directory, SIZE_FILE), "w") as f:
+            f.write(str(self.total_bytes))
+
+    def _entries(self):
+        # (mtime, path, size) for every cached PDF
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pdf"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                pdf_bytes = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(path)  # mtime doubles as the LRU timestamp
+        self.hits += 1
+        return pdf_bytes
+
+    def put(self, key, pdf_bytes):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        # Re-read each time, before this PDF is in the directory: other runs add to the same cache
+        total_bytes = self._stored_total()
+        # Write to a temp file and rename so readers never see a partial PDF
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+        self.total_bytes = total_bytes + len(pdf_bytes)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        self._store_total()
+
+    def evict(self):
+        # Drop least recently used PDFs until the cache is back under 90% of its limit
+        entries = sorted(self._entries())
+        self.total_bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+        logging.debug(f"Label cache evicted down to {self.total_bytes} bytes")
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 3) if lookups else None
@@ -0,0 +1,75 @@
+#!/usr/local/bin/python3
+import os
+import sys
+import json
+import socket
+import getopt
+
+# Thin client for label_daemon.py. Takes the same -s/-p/-d/-c arguments as GOD_TIER.py,
+# but the label is laid out and printed by the already running daemon, so a call only
+# costs a bare interpreter start and one round trip over the socket. Standard library
+# only, on purpose.
+
+help_message = "Usage: label_client.py -s SERIAL -p PROJECT [-d DEVELOPMENT_PHASE] [-c config] [--apple-watch | --format NAME] [--socket PATH]"
+
+LABEL_SOCKET = os.path.expanduser("~/.label_daemon.sock")
+REQUEST_TIMEOUT = 120  # seconds; the reply only comes once the job has reached the printer
+
+
+def send_request(request, path=LABEL_SOCKET, timeout=REQUEST_TIMEOUT):
+    # One JSON object per line each way
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps(request) + "\n").encode())
+        reply = sock.makefile("rb").readline()
+    if not reply:
+        raise ConnectionError("Label daemon closed the connection without replying")
+    return json.loads(reply)
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hs:p:d:c:", ["apple-watch", "format=", "socket="])
+    except getopt.GetoptError:
+        print(help_message)
+        exit(1)
+
+    request = {"phase": "", "config": "", "format": "dymo-54x25"}
+    path = LABEL_SOCKET
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            exit(0)
+        elif opt == "--apple-watch":  # GOD_TIER.py --watch follows a TSV instead
+            request["format"] = "dymo-28x28"
+        elif opt == "--format":
+            request["format"] = arg
+        elif opt == "--socket":
+            path = arg
+        elif opt == "-s":
+            request["serial"] = arg
+        elif opt == "-p":
+            request["project"] = arg
+        elif opt == "-d":
+            request["phase"] = arg
+        elif opt == "-c":
+            request["config"] = arg
+
+    if not request.get("serial") or not request.get("project"):
+        print(help_message)
+        exit(1)
+
+    try:
+        reply = send_request(request, path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"Label daemon is not running on {path}; start it with label_daemon.py")
+        exit(1)
+    if not reply["ok"]:
+        print(f"Label failed: {reply['error']}")
+        exit(1)
+    print(f"Sent to the printer ({reply['labels']} labels in the job)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,197 @@
+#!/usr/local/bin/python3
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future
+from GOD_TIER import LABEL_ROOT, add_label, make_qr, render_label, open_printer
+from label_formats import LABEL_FORMATS, find_format
+from label_client import LABEL_SOCKET
+from label_output import run_directory, batch_file_name, write_atomic
+from label_rows import clean_field
+from printer_backends import PrintError
+from spooler import Spooler
+
+# Resident label server for callers that print one label at a time (e.g. the MES calling
+# once per device). qrcode, fpdf and the fonts are loaded once and the label templates
+# stay compiled; label_client.py sends the same fields as GOD_TIER.py -s/-p/-d/-c over a
+# Unix socket. Requests that arrive within BATCH_WINDOW of each other are laid out as
+# pages of one PDF and sent as one print job; every caller gets its reply once that job
+# has been handed to the printer. Job files are deleted once they have been sent (the
+# ones that failed are kept), so a daemon that runs for months doesn't fill its directory.
+
+BATCH_WINDOW = 0.1  # seconds to wait for more requests after the first one; a caller waiting on its reply can't batch with itself, so keep it short
+BATCH_MAX = 100  # labels per print job at most
+
+
+def parse_request(request):
+    # Same clean-up as GOD_TIER.py does for -s/-p/-d/-c
+    serial = str(request.get("serial", "")).strip()
+    project = clean_field(str(request.get("project", "")))
+    if not serial or not project:
+        raise ValueError("serial and project are required")
+    label_format = find_format(request.get("format", 'dymo-54x25')).name
+    phase = clean_field(str(request.get("phase", "")))
+    config = clean_field(str(request.get("config", "")))
+    return (project, phase, config, serial), label_format
+
+
+class LabelDaemon:
+    def __init__(self, backend="auto", root=LABEL_ROOT, batch_window=BATCH_WINDOW):
+        self.backend = backend
+        self.batch_window = batch_window
+        self.directory = run_directory(root)
+        self.requests = queue.Queue()
+        self.spoolers = {}  # label format -> Spooler with a printer session for that media
+        self.labels = 0
+        self.thread = threading.Thread(target=self._batch_requests, name="label-batcher", daemon=True)
+
+    def start(self):
+        # Load fpdf, qrcode and the fonts now rather than on the first request
+        for label_format in LABEL_FORMATS:
+            render_label(("WARMUP", "", "", "WARMUP"), label_format)
+        logging.info(f"Label daemon writing labels to {self.directory}")
+        self.thread.start()
+
+    def request(self, row, label_format):
+        # Called from connection threads; the future resolves with the reply for the client
+        future = Future()
+        self.requests.put((row, label_format, future))
+        return future
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+        for spooler in self.spoolers.values():
+            spooler.close()
+        try:
+            os.rmdir(self.directory)  # only goes if no failed job was left in it
+        except OSError:
+            pass
+
+    def _batch_requests(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.batch_window
+            stopping = False
+            while len(batch) < BATCH_MAX:
+                try:
+                    item = self.requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            by_format = {}
+            for item in batch:
+                by_format.setdefault(item[1], []).append(item)
+            for label_format, items in by_format.items():
+                self._print_batch(label_format, items)
+            if stopping:
+                return
+
+    def _print_batch(self, label_format, items):
+        first_label = self.labels + 1
+        self.labels += len(items)
+        file_name = os.path.join(self.directory, batch_file_name(first_label, self.labels))
+        futures = [future for _, _, future in items]
+        try:
+            pdf = LABEL_FORMATS[label_format].new_pdf()
+            for (project, phase, config, serial), _, _ in items:
+                add_label(pdf, serial, project, phase, config, make_qr(serial), label_format)
+            write_atomic(file_name, bytes(pdf.output()))
+            spooler = self.spoolers.get(label_format)
+            if spooler is None:
+                spooler = self.spoolers[label_format] = Spooler(open_printer(label_format, self.backend))
+        except Exception as e:
+            logging.error(f"Label daemon could not print {file_name}: {e}")
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        def done(sent):
+            if sent:
+                try:
+                    os.remove(file_name)
+                except FileNotFoundError:
+                    pass
+            for future in futures:
+                if sent:
+                    future.set_result({"labels": len(items)})
+                else:
+                    future.set_exception(PrintError(f"Could not print {file_name}"))
+
+        logging.info(f"Label daemon queued {file_name} ({len(items)} labels)")
+        spooler.submit(file_name, done)
+
+
+class LabelRequestHandler(socketserver.StreamRequestHandler):
+    # One JSON request per line, answered with one JSON line: {"ok": true, "labels": N} (N being the
+    # labels in the print job it went out with) or {"ok": false, "error": ...}
+    def handle(self):
+        for line in self.rfile:
+            try:
+                row, label_format = parse_request(json.loads(line))
+                reply = {"ok": True, **self.server.labels.request(row, label_format).result()}
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class LabelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, labels):
+        self.labels = labels
+        super().__init__(path, LabelRequestHandler)
+
+
+def remove_stale_socket(path):
+    # A socket file left behind by a daemon that died; refuse to start next to a live one
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(path)
+            return
+    raise SystemExit(f"A label daemon is already listening on {path}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Keep the label pipeline loaded and print labels sent by label_client.py.")
+    parser.add_argument("--socket", default=LABEL_SOCKET, help=f"Unix socket to listen on (default {LABEL_SOCKET}).")
+    parser.add_argument("--backend", default="auto", help="Printer backend: auto, cups, lpr or file:DIR.")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW, help="Seconds to collect requests into one print job.")
+    args = parser.parse_args(argv)
+
+    remove_stale_socket(args.socket)
+    labels = LabelDaemon(args.backend, batch_window=args.batch_window)
+    labels.start()
+    server = LabelServer(args.socket, labels)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # stop cleanly under a service manager too
+    print(f"Label daemon listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        labels.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
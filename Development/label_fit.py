@@ -0,0 +1,65 @@
+import os
+import json
+import math
+import logging
+from functools import lru_cache
+
+# Auto-fit for text slots that declare a width: the largest font size, up to the slot's
+# own, at which the text fits, instead of letting a long project or config run off the
+# label. Widths come from the PDF core fonts' Adobe metrics (the tables fpdf measures
+# with), kept in core_font_widths.json as 1/1000 em per Latin-1 character, so fitting
+# needs neither fpdf nor a font file: a string is measured by summing table entries,
+# once per distinct (string, font, size).
+
+WIDTHS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "core_font_widths.json")
+
+# Smallest size a slot is shrunk to, in pt; text still too wide at this size overflows
+# (with a warning in labels.log)
+MIN_FONT_SIZE = 4
+
+# Distinct strings kept measured; projects, phases and configs repeat across a build
+FIT_CACHE_SIZE = 4096
+
+# fpdf draws these families with the metrics of a core font
+FAMILY_ALIASES = {'arial': 'helvetica'}
+
+MM_PER_PT = 25.4 / 72
+
+
+@lru_cache(maxsize=None)
+def width_tables():
+    with open(WIDTHS_FILE) as f:
+        return {name: tuple(widths) for name, widths in json.load(f).items()}
+
+
+@lru_cache(maxsize=64)
+def width_table(family, style):
+    family = family.lower()
+    # fpdf writes bold italic as 'BI' whichever order it was given in
+    style = ('B' if 'B' in style.upper() else '') + ('I' if 'I' in style.upper() else '')
+    try:
+        return width_tables()[FAMILY_ALIASES.get(family, family) + style]
+    except KeyError:
+        raise ValueError(f"No width table for font {family} {style}; auto-fit only knows the PDF core fonts") from None
+
+
+@lru_cache(maxsize=FIT_CACHE_SIZE)
+def text_width(text, family, style, size):
+    # Width in mm. Core fonts only cover Latin-1; anything else is measured as '?'.
+    table = width_table(family, style)
+    return sum(map(table.__getitem__, text.encode('latin-1', 'replace'))) * size / 1000 * MM_PER_PT
+
+
+@lru_cache(maxsize=FIT_CACHE_SIZE)
+def fit_size(text, family, style, size, width, min_size=MIN_FONT_SIZE):
+    # Largest size up to `size`, in 0.1 pt steps, at which the text is at most `width` mm wide.
+    # Width grows linearly with size, so this is one measurement, not a search.
+    natural = text_width(text, family, style, size)
+    if natural <= width:
+        return size
+    min_size = min(min_size, size)
+    fitted = math.floor(size * width / natural * 10) / 10
+    if fitted < min_size:
+        logging.warning(f"'{text}' is {text_width(text, family, style, min_size):.1f} mm wide at {min_size} pt, overflowing its {width} mm slot")
+        return min_size
+    return fitted
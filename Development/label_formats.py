@@ -0,0 +1,118 @@
+import os
+import json
+import zlib
+from collections import namedtuple
+from label_layout import LabelTemplate
+from label_fit import MIN_FONT_SIZE
+
+# Every label format in one place: page size, orientation, QR box, text slots and printer
+# media, declared in label_formats.json in millimetres. Each format is compiled into a
+# LabelTemplate once at load, so every script renders through the same path. Adding a
+# label size means adding an entry to the JSON file, not copying another script.
+# (Plain classes and namedtuples rather than dataclasses, which pull in inspect and add
+# ~15 ms to every CLI start.)
+
+FORMATS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "label_formats.json")
+
+# rotate is in degrees, around the box's top left corner
+QrBox = namedtuple('QrBox', 'x y size rotate', defaults=(0,))
+# text is a format string over the row fields, e.g. "{serial}"; font is (family, style,
+# size in pt), or None to keep the previous slot's font. With a width (mm) the font is
+# shrunk, down to min_font_size pt, until the text fits.
+TextSlot = namedtuple('TextSlot', 'x y text font width min_font_size', defaults=(None, None, MIN_FONT_SIZE))
+# Turns all the text slots together
+TextRotation = namedtuple('TextRotation', 'angle x y')
+
+
+class LabelFormat:
+    def __init__(self, name, size, qr, text, orientation='P', text_rotation=None, media=None, options=None, description="", layout_id=None):
+        self.name = name
+        self.size = size  # (width, height) in mm, as handed to fpdf
+        self.qr = qr
+        self.text = text  # TextSlots, drawn in order
+        self.orientation = orientation
+        self.text_rotation = text_rotation
+        self.media = media  # CUPS media name; None leaves it to the printer's default
+        self.options = options or {}  # further CUPS job options
+        self.description = description
+        self.layout_id = layout_id or name  # changes whenever the layout does, for cache keys
+        if not text or not text[0].font:
+            raise ValueError(f"Label format {name}: the first text slot needs a font")
+        self.template = compile_template(self)
+
+    def __repr__(self):
+        return f"LabelFormat({self.name!r}, {self.size[0]}x{self.size[1]} mm)"
+
+    def new_pdf(self):
+        return self.template.new_pdf()
+
+    def render(self, pdf, fields, qr):
+        self.template.render(pdf, fields, qr)
+
+    def printer_options(self):
+        options = dict(self.options)
+        if self.media:
+            options["media"] = self.media
+        return options
+
+
+def compile_template(label_format):
+    # Turn the declaration into the template's drawing steps
+    template = LabelTemplate(label_format.size, label_format.orientation)
+    qr = label_format.qr
+    if qr.rotate:
+        template.rotate(qr.rotate, qr.x, qr.y)
+    template.qr(qr.x, qr.y, qr.size)
+    if qr.rotate:
+        template.rotate(0)
+    rotation = label_format.text_rotation
+    if rotation:
+        template.rotate(rotation.angle, rotation.x, rotation.y)
+    font = None
+    shrunk = False  # the last slot was fitted and may have left a smaller font current
+    for slot in label_format.text:
+        font = slot.font or font
+        if slot.width:
+            template.fit_text(slot.x, slot.y, slot.text, slot.width, *font, slot.min_font_size)
+        else:
+            if slot.font or shrunk:
+                template.font(*font)
+            template.text(slot.x, slot.y, slot.text)
+        shrunk = bool(slot.width)
+    if rotation:
+        template.rotate(0)
+    return template
+
+
+def parse_format(name, entry):
+    try:
+        return LabelFormat(
+            name=name,
+            size=tuple(entry["size"]),
+            qr=QrBox(**entry["qr"]),
+            text=tuple(TextSlot(**{**slot, "font": tuple(slot["font"]) if slot.get("font") else None}) for slot in entry["text"]),
+            orientation=entry.get("orientation", 'P'),
+            text_rotation=TextRotation(**entry["text_rotation"]) if entry.get("text_rotation") else None,
+            media=entry.get("media"),
+            options=entry.get("options", {}),
+            description=entry.get("description", ""),
+            layout_id=f"{name}/{zlib.crc32(json.dumps(entry, sort_keys=True).encode()):08x}",
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Label format {name} is incomplete or has unknown fields: {e}")
+
+
+def load_formats(path=FORMATS_FILE):
+    with open(path) as f:
+        entries = json.load(f)
+    return {name: parse_format(name, entry) for name, entry in entries.items()}
+
+
+LABEL_FORMATS = load_formats()
+
+
+def find_format(name):
+    try:
+        return LABEL_FORMATS[name]
+    except KeyError:
+        raise ValueError(f"Unknown label format {name}, expected one of: {', '.join(LABEL_FORMATS)}") from None
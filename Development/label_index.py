@@ -0,0 +1,190 @@
+import os
+import time
+import zlib
+import mmap
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+from label_output import write_atomic
+from label_rows import header_indexes, parse_line
+
+# Random access into a TSV export for reprints: "<file>.index" next to the TSV holds the
+# byte offset of every row plus its serial (hashed, sorted), so rows 1200-1300 or
+# serial D94 are read by seeking straight to them instead of parsing the whole export.
+# The index is built once, with one pass over the mmapped file, and rebuilt whenever the
+# TSV's size or mtime no longer match it. Both files are mmapped, so opening the index
+# of a multi-million row export reads only the pages a lookup touches.
+# Rows are numbered like read_tsv() numbers them (from 1 after the header, blank lines
+# skipped), which is also the number in each label's file name. Like the watch mode,
+# rows are taken to be single lines (no quoted line breaks).
+
+INDEX_SUFFIX = ".index"
+INDEX_MAGIC = b"LBLIDX01"
+
+# magic, TSV size, TSV mtime (ns), rows, header line length; then rows row offsets ('Q'),
+# then rows keys ('Q'): crc32 of the serial << 32 | row number, sorted
+INDEX_HEADER = struct.Struct('=8sQqQQ')
+
+
+def parse_row_ranges(text):
+    # "1200-1300,1405" -> [(1200, 1300), (1405, 1405)]
+    ranges = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise ValueError(f"Bad row range '{part}', expected e.g. 1200-1300 or 1405") from None
+        if first < 1 or last < first:
+            raise ValueError(f"Bad row range '{part}': rows count from 1 and ranges go upwards")
+        ranges.append((first, last))
+    return ranges
+
+
+def serial_key(serial):
+    return zlib.crc32(serial.strip().encode('utf-8')) << 32
+
+
+def sorted_keys(keys):
+    # The keys sorted, as bytes. numpy sorts 2M of them in ~50 ms; sorted() takes seconds,
+    # since every key becomes a Python int
+    try:
+        import numpy as np
+    except ImportError:
+        return array('Q', sorted(keys)).tobytes()
+    return np.sort(np.frombuffer(keys, dtype=np.uint64)).tobytes()
+
+
+class TsvIndex:
+    # The mmapped TSV and its index, loaded from "<file>.index" or built and saved there
+    def __init__(self, path, serial_column='serial'):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.index_map = None
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if not stat.st_size:
+                raise ValueError(f"{path} is empty")
+            self.tsv_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_line = self.tsv_map[:self.tsv_map.find(b'\n') + 1]
+        self.header = [name.strip().lower() for name in parse_line(header_line)]
+        self.serial_index = header_indexes(self.header, (serial_column,))[0]
+        buffer = self.load(stat)
+        if buffer is None:
+            buffer = self.build(stat, len(header_line))
+            self.save(buffer)
+        self.open_views(buffer)
+
+    def load(self, stat):
+        try:
+            with open(self.index_path, 'rb') as f:
+                index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None  # ValueError: an empty index file can't be mapped
+        if len(index_map) >= INDEX_HEADER.size:
+            magic, size, mtime, rows, header_length = INDEX_HEADER.unpack_from(index_map)
+            if (magic, size, mtime) == (INDEX_MAGIC, stat.st_size, stat.st_mtime_ns) and len(index_map) == INDEX_HEADER.size + 16 * rows:
+                self.index_map = index_map
+                return index_map
+        index_map.close()
+        logging.info(f"{self.index_path} is out of date, rebuilding it")
+        return None
+
+    def build(self, stat, header_length):
+        # One pass over the mmapped TSV: where every non-blank line starts, and its serial
+        started = time.perf_counter()
+        data = self.tsv_map
+        offsets = array('Q')
+        keys = array('Q')
+        serial_index = self.serial_index
+        position = header_length
+        data.seek(header_length)
+        for line in iter(data.readline, b''):
+            if line.strip():
+                fields = line.split(b'\t', serial_index + 1)
+                serial = fields[serial_index] if len(fields) > serial_index else b""
+                offsets.append(position)
+                keys.append(zlib.crc32(serial.strip()) << 32 | len(offsets))
+            position += len(line)
+        logging.info(f"Indexed {len(offsets)} rows of {self.path} in {time.perf_counter() - started:.2f} s")
+        header = INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets), header_length)
+        return header + offsets.tobytes() + sorted_keys(keys)
+
+    def save(self, buffer):
+        try:
+            write_atomic(self.index_path, buffer)
+        except OSError as e:
+            logging.warning(f"Could not save {self.index_path} ({e}), it will be rebuilt next time")
+
+    def open_views(self, buffer):
+        rows = INDEX_HEADER.unpack_from(buffer)[3]
+        self.view = memoryview(buffer)
+        start = INDEX_HEADER.size
+        self.offsets = self.view[start:start + 8 * rows].cast('Q')
+        self.keys = self.view[start + 8 * rows:start + 16 * rows].cast('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def line(self, row_number):
+        start = self.offsets[row_number - 1]
+        end = self.tsv_map.find(b'\n', start)
+        return self.tsv_map[start:len(self.tsv_map) if end < 0 else end + 1]
+
+    def find_serial(self, serial):
+        # Row numbers whose serial column is exactly serial (hash matches are checked)
+        serial = serial.strip()
+        key = serial_key(serial)
+        rows = []
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] >> 32 == key >> 32:
+            row_number = self.keys[i] & 0xFFFFFFFF
+            fields = parse_line(self.line(row_number))
+            if len(fields) > self.serial_index and fields[self.serial_index].strip() == serial:
+                rows.append(row_number)
+            i += 1
+        return rows
+
+    def close(self):
+        # The views have to go before the mmap they point into can be closed
+        self.offsets.release()
+        self.keys.release()
+        self.view.release()
+        self.tsv_map.close()
+        if self.index_map is not None:
+            self.index_map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def select_rows(filepath, columns, ranges=(), serials=()):
+    # (row_number, row) for the chosen rows, in file order; row is a tuple of the given
+    # columns like read_tsv() hands back
+    with TsvIndex(filepath) as index:
+        wanted = set()
+        for first, last in ranges:
+            if first > len(index):
+                logging.warning(f"Rows {first}-{last} are past the end of {filepath} ({len(index)} rows)")
+            wanted.update(range(first, min(last, len(index)) + 1))
+        for serial in serials:
+            found = index.find_serial(serial)
+            if not found:
+                logging.warning(f"Serial {serial} is not in {filepath}")
+                print(f"Serial {serial} not found in {filepath}")
+            wanted.update(found)
+        indexes = header_indexes(index.header, columns)
+        last = max(indexes)
+        for row_number in sorted(wanted):
+            fields = parse_line(index.line(row_number))
+            if len(fields) <= last:
+                raise ValueError(f"Row {row_number} has {len(fields)} columns, expected {len(index.header)}")
+            yield row_number, tuple(fields[i].strip() for i in indexes)
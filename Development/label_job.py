@@ -0,0 +1,133 @@
+import time
+import queue
+import threading
+from tkinter import Frame, Label, Button
+from tkinter.ttk import Progressbar
+
+# Label batches run on a worker thread so the window keeps responding. The worker
+# never touches Tk: it posts messages on a queue and the window drains it with
+# root.after (ProgressPanel), showing rows/sec and ETA and offering Cancel.
+
+POLL_MS = 100  # how often the window checks on the worker
+PROGRESS_INTERVAL = 0.1  # seconds between progress messages, so 100k rows don't flood the queue
+
+
+def count_lines(filepath):
+    # Rough row count for the progress bar: newlines, counted in 1 MB binary reads, minus
+    # the header. Far cheaper than parsing the TSV; blank lines are counted too.
+    lines = 0
+    last = b'\n'
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n':
+        lines += 1  # no newline after the last row
+    return max(lines - 1, 0)
+
+
+class LabelJob:
+    # Runs work(job, *args) on a worker thread. The worker sets job.total once known,
+    # calls job.progress(rows_done) and stops early when job.cancelled is set.
+    # Posts ('progress', done, total, rate), then ('done', result) or ('error', exception).
+    def __init__(self, work, *args):
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.total = None
+        self.started = None
+        self.last_progress = 0
+        self.thread = threading.Thread(target=self._run, args=(work, args), name="label-job", daemon=True)
+        self.thread.start()
+
+    def _run(self, work, args):
+        try:
+            result = work(self, *args)
+        except Exception as e:
+            self.messages.put(('error', e))
+        else:
+            self.messages.put(('done', result))
+
+    def progress(self, done):
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        if now - self.last_progress >= PROGRESS_INTERVAL or done == self.total:
+            self.last_progress = now
+            elapsed = now - self.started
+            self.messages.put(('progress', done, self.total, done / elapsed if elapsed else 0))
+
+    def count_in_background(self, filepath):
+        # Fill in total from count_lines() on a thread of its own, so the first labels don't wait for it
+        threading.Thread(target=self._count, args=(filepath,), name="label-count", daemon=True).start()
+
+    def _count(self, filepath):
+        try:
+            self.total = count_lines(filepath)
+        except OSError:
+            pass  # the worker's own read of the file reports it
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class ProgressPanel(Frame):
+    # Progress bar, rows/sec and ETA for a LabelJob, with a Cancel button
+    def __init__(self, master):
+        super().__init__(master)
+        self.bar = Progressbar(self, length=300, mode='determinate')
+        self.bar.pack(pady=5)
+        self.status = Label(self, text="")
+        self.status.pack()
+        self.cancel_btn = Button(self, text="Cancel", command=self.cancel, state='disabled')
+        self.cancel_btn.pack(pady=5)
+        self.job = None
+
+    def run(self, job, on_done, on_error):
+        # on_done(result) / on_error(exception) are called on the Tk thread when the job ends
+        self.job = job
+        self.bar.config(value=0, maximum=1)
+        self.status.config(text="Reading file...")
+        self.cancel_btn.config(state='normal')
+        self.after(POLL_MS, self.poll, on_done, on_error)
+
+    def cancel(self):
+        if self.job:
+            self.job.cancel()
+            self.cancel_btn.config(state='disabled')
+            self.status.config(text="Cancelling, finishing the labels already read...")
+
+    def poll(self, on_done, on_error):
+        try:
+            while True:
+                message = self.job.messages.get_nowait()
+                if message[0] == 'progress':
+                    self.show_progress(*message[1:])
+                    continue
+                self.job = None
+                self.cancel_btn.config(state='disabled')
+                if message[0] == 'done':
+                    on_done(message[1])
+                else:
+                    on_error(message[1])
+                return
+        except queue.Empty:
+            pass
+        self.after(POLL_MS, self.poll, on_done, on_error)
+
+    def show_progress(self, done, total, rate):
+        if total:
+            total = max(total, done)  # the count is only a line count
+            self.bar.config(maximum=total, value=done)
+            eta = format_eta((total - done) / rate) if rate else "--"
+            text = f"{done}/{total} labels, {rate:.1f} labels/s, ETA {eta}"
+        else:
+            text = f"{done} labels, {rate:.1f} labels/s"
+        if self.job.cancelled.is_set():
+            text = f"Cancelling... {text}"
+        self.status.config(text=text)
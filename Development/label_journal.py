@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+
+# Append-only journal of a --file run, "<file>.journal" next to the TSV: one line per
+# row as its label is rendered and again once it was sent to the printer (or given up
+# on, or found impossible to draw). After a crash, a failed lpr or the machine going to
+# sleep, --resume reads it back and skips every row that was already sent, with one dict
+# lookup per row, so only the remaining rows are rendered and printed again; the run's
+# labels keep going into the same directory. Writes are fsynced in batches: a crash loses at most the last
+# JOURNAL_SYNC_EVERY records / JOURNAL_SYNC_SECONDS, i.e. those few rows are printed twice.
+# A timer syncs the records that would otherwise wait for the next write (a slow printer,
+# a long render), so the time bound holds when writes stop too.
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_SYNC_EVERY = 64  # records between fsyncs
+JOURNAL_SYNC_SECONDS = 1.0  # and at most this long
+
+RENDERED = "rendered"
+SPOOLED = "spooled"
+FAILED = "failed"
+
+
+def row_fingerprint(row):
+    # So a resumed row is only skipped if the TSV still has the same fields at that row number
+    return format(zlib.crc32("\t".join(row).encode('utf-8')), '08x')
+
+
+class Journal:
+    # run describes what the labels look like (format, raw, sheet...); a journal is only
+    # resumed by a run with the same description
+    def __init__(self, path, run, resume=False):
+        self.path = path
+        self.run = run
+        self.directory = None  # label directory of the run being resumed
+        self.spooled = {}  # row number -> fingerprint, for rows already sent
+        self.rendered = 0
+        self.skipped = 0
+        self.lock = threading.Lock()  # spool threads record rows too
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.timer = None  # pending sync for records written since the last one
+        self.torn = False
+        if resume:
+            self.load()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if self.torn:
+            self.file.write('\n')  # so the next record starts on a line of its own
+
+    def load(self):
+        try:
+            f = open(self.path, encoding='utf-8')
+        except FileNotFoundError:
+            raise ValueError(f"Nothing to resume: {self.path} does not exist") from None
+        run = None
+        with f:
+            for line in f:
+                if not line.endswith('\n'):
+                    self.torn = True  # last write cut short by a crash
+                    break
+                fields = line.rstrip('\n').split('\t')
+                try:
+                    if fields[0] == "run":
+                        run = json.loads(fields[1])
+                        self.directory = run.pop("directory", None)
+                    elif fields[0] == SPOOLED:
+                        self.spooled[int(fields[1])] = fields[2]
+                    elif fields[0] == FAILED:
+                        self.spooled.pop(int(fields[1]), None)
+                except (IndexError, ValueError) as e:
+                    logging.warning(f"Skipping bad line in {self.path}: {line!r} ({e})")
+        if run != self.run:
+            raise ValueError(f"{self.path} is from a run with {run}, not {self.run}; run without --resume to start over")
+        logging.info(f"Resuming from {self.path}: {len(self.spooled)} rows already printed")
+
+    def start(self, directory):
+        self._write("run\t" + json.dumps({**self.run, "directory": directory}) + "\n", sync=True)
+
+    def done(self, row_number, row):
+        # O(1): was this exact row sent by an earlier run?
+        if self.spooled.get(row_number) == row_fingerprint(row):
+            self.skipped += 1
+            return True
+        return False
+
+    def record_rendered(self, row_number, row, file_name):
+        self.rendered += 1
+        self._write(f"{RENDERED}\t{row_number}\t{row_fingerprint(row)}\t{file_name}\n")
+
+    def record_failed(self, row_number, row, error):
+        # A row whose label couldn't be drawn; like a failed job, --resume tries it again
+        error = " ".join(str(error).split())
+        self._write(f"{FAILED}\t{row_number}\t{row_fingerprint(row)}\t{error}\n")
+
+    def marker(self, numbered_rows):
+        # done(sent) callback for Spooler.submit: journals every (row_number, row) of the job
+        lines = [(row_number, row_fingerprint(row)) for row_number, row in numbered_rows]
+
+        def done(sent):
+            state = SPOOLED if sent else FAILED
+            self._write("".join(f"{state}\t{row_number}\t{fingerprint}\n" for row_number, fingerprint in lines))
+        return done
+
+    def _write(self, text, sync=False):
+        with self.lock:
+            self.file.write(text)
+            self.unsynced += 1
+            if sync or self.unsynced >= JOURNAL_SYNC_EVERY or time.monotonic() - self.last_sync >= JOURNAL_SYNC_SECONDS:
+                self._sync()
+            elif self.timer is None:
+                self.timer = threading.Timer(JOURNAL_SYNC_SECONDS, self._sync_later)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _sync_later(self):
+        with self.lock:
+            self.timer = None
+            if self.unsynced and not self.file.closed:
+                self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self._sync()
+            self.file.close()
+
+
+def open_journal(path, run, resume=False):
+    # A Journal, or a NullJournal when it can't be written (e.g. the TSV sits in a read-only
+    # directory): the run still prints, it just can't be resumed. Resuming from a journal
+    # that can't be opened is a ValueError like a missing one.
+    try:
+        return Journal(path, run, resume)
+    except OSError as e:
+        if resume:
+            raise ValueError(f"Can't resume from {path}: {e}") from None
+        logging.warning(f"Not journalling this run, {path} can't be written: {e}")
+        print(f"Warning: can't write {path} ({e.strerror or e}); this run can't be resumed")
+        return NullJournal()
+
+
+class NullJournal:
+    # Stand-in when a run isn't journalled (reprints of --rows / --serial)
+    directory = None
+    skipped = 0
+
+    def start(self, directory):
+        pass
+
+    def done(self, row_number, row):
+        return False
+
+    def record_rendered(self, row_number, row, file_name):
+        pass
+
+    def record_failed(self, row_number, row, error):
+        pass
+
+    def marker(self, numbered_rows):
+        return None
+
+    def close(self):
+        pass
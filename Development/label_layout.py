@@ -0,0 +1,113 @@
+from qr_matrix import place_qr
+from label_fit import fit_size
+
+# A label format compiled once into a flat list of drawing steps with every
+# coordinate, font size and transform already worked out. Rendering a row only
+# fills in the QR and the text; nothing about the geometry is recomputed.
+# Building a template doesn't touch fpdf, which is only imported (~0.3 s) once
+# a PDF is actually made.
+
+# Sheet stock for N-up printing, portrait width x height in mm
+SHEET_SIZES = {'letter': (215.9, 279.4), 'a4': (210, 297)}
+SHEET_MARGIN = 10  # mm around the grid of labels
+SHEET_GUTTER = 2  # mm between neighbouring labels
+
+
+class LabelTemplate:
+    def __init__(self, page_format, orientation='P'):
+        self.page_format = page_format
+        self.orientation = orientation
+        self.steps = []
+
+    # Building the template (once per format)
+
+    def rotate(self, angle, x=None, y=None):
+        self.steps.append(('rotate', (angle, x, y)))
+        return self
+
+    def font(self, family, style, size):
+        self.steps.append(('font', (family, style, size)))
+        return self
+
+    def qr(self, x, y, size):
+        self.steps.append(('qr', (x, y, size)))
+        return self
+
+    def text(self, x, y, text):
+        # text is a format string over the row fields, e.g. "{serial}"
+        self.steps.append(('text', (x, y, text)))
+        return self
+
+    def fit_text(self, x, y, text, width, family, style, size, min_size):
+        # Text in the largest font up to size that keeps it within width mm (label_fit.py);
+        # leaves that font current
+        self.steps.append(('fit', (x, y, text, width, family, style, size, min_size)))
+        return self
+
+    # Rendering (once per row)
+
+    def new_pdf(self):
+        import fpdf
+        return fpdf.FPDF(orientation=self.orientation, unit='mm', format=self.page_format)
+
+    def label_size(self):
+        # Width and height of the label as fpdf lays out the page ('L' swaps them)
+        width, height = self.page_format
+        return (width, height) if self.orientation == 'P' else (height, width)
+
+    def render(self, pdf, fields, qr):
+        pdf.add_page()
+        self.draw(pdf, fields, qr)
+
+    def draw(self, pdf, fields, qr, x=0, y=0):
+        # Draw the label with its top left corner at (x, y) on the current page
+        for step, args in self.steps:
+            if step == 'text':
+                text_x, text_y, text = args
+                pdf.text(x=x + text_x, y=y + text_y, txt=text.format_map(fields))
+            elif step == 'font':
+                pdf.set_font(*args)  # fpdf skips this when the font is already current
+            elif step == 'fit':
+                text_x, text_y, text, width, family, style, size, min_size = args
+                text = text.format_map(fields)
+                pdf.set_font(family, style, fit_size(text, family, style, size, width, min_size))
+                pdf.text(x=x + text_x, y=y + text_y, txt=text)
+            elif step == 'qr':
+                qr_x, qr_y, size = args
+                place_qr(pdf, qr, x + qr_x, y + qr_y, size)
+            else:
+                angle, center_x, center_y = args
+                pdf.rotate(angle, None if center_x is None else x + center_x, None if center_y is None else y + center_y)
+
+
+class SheetLayout:
+    # N-up imposition: labels from one template tiled in a grid on letter/A4 stock,
+    # filled row by row. Every cell on every page shares the document's fonts and the
+    # cached QR matrices, so a 3,000 label run is a few dozen pages instead of 3,000.
+    def __init__(self, template, sheet='letter', margin=SHEET_MARGIN, gutter=SHEET_GUTTER):
+        self.template = template
+        self.sheet = sheet
+        self.margin = margin
+        self.gutter = gutter
+        self.page_format = SHEET_SIZES[sheet]
+        sheet_width, sheet_height = self.page_format
+        label_width, label_height = template.label_size()
+        columns = int((sheet_width - 2 * margin + gutter) // (label_width + gutter))
+        rows = int((sheet_height - 2 * margin + gutter) // (label_height + gutter))
+        if columns < 1 or rows < 1:
+            raise ValueError(f"A {label_width}x{label_height} mm label does not fit on {sheet} with {margin} mm margins")
+        self.columns = columns
+        self.rows = rows
+        self.cells = [(margin + column * (label_width + gutter), margin + row * (label_height + gutter))
+                      for row in range(rows) for column in range(columns)]
+        self.per_sheet = len(self.cells)
+
+    def new_pdf(self):
+        import fpdf
+        return fpdf.FPDF(orientation='P', unit='mm', format=self.page_format)
+
+    def render(self, pdf, labels):
+        # One new sheet with up to per_sheet labels, given as (fields, qr) pairs
+        pdf.add_page()
+        for (x, y), (fields, qr) in zip(self.cells, labels):
+            self.template.draw(pdf, fields, qr, x, y)
@@ -0,0 +1,103 @@
+import json
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+
+# Timings for the label pipeline, written to labels.log as one JSON object per line:
+#   {"event": "stage", ...}    one stage of one row, for 1 row in METRICS_SAMPLE_EVERY
+#   {"event": "summary", ...}  running totals every METRICS_SUMMARY_SECONDS and at the end of a run
+# Totals always cover every row; only the per-row lines are sampled, so a 100k row run stays cheap.
+# Stages: parse (reading a TSV row), qr (encoding), layout (drawing the label),
+# write (serializing the PDF) and spool (writing the job file and queueing it). Rows rendered
+# on a process pool are timed as a single render stage instead of qr, layout and write.
+
+METRICS_SAMPLE_EVERY = 100  # 1 logs every row, 0 turns per-row lines off
+METRICS_SUMMARY_SECONDS = 5.0
+
+logger = logging.getLogger('labels.metrics')
+
+
+class Metrics:
+    def __init__(self, run, sample_every=METRICS_SAMPLE_EVERY, summary_seconds=METRICS_SUMMARY_SECONDS):
+        self.run = run
+        self.sample_every = sample_every
+        self.summary_seconds = summary_seconds
+        self.rows = 0
+        self.counts = {}
+        self.totals = {}
+        self.maxima = {}
+        self.gauges = {}
+        self.started = time.perf_counter()
+        self.next_summary = self.started + summary_seconds
+
+    def watch(self, name, read):
+        # read() is called for every summary, e.g. the spool queue depth or a cache hit rate
+        self.gauges[name] = read
+
+    @contextmanager
+    def timed(self, stage, row=None):
+        started = time.perf_counter_ns()
+        yield
+        self.record(stage, time.perf_counter_ns() - started, row)
+
+    def rows_from(self, rows):
+        # Pass rows through, timing each read from the TSV as the parse stage
+        rows = iter(rows)
+        while True:
+            started = time.perf_counter_ns()
+            row = next(rows, None)
+            if row is None:
+                return
+            self.rows += 1
+            self.record('parse', time.perf_counter_ns() - started, self.rows)
+            yield row
+
+    def record(self, stage, ns, row=None):
+        count = self.counts.get(stage, 0) + 1
+        self.counts[stage] = count
+        self.totals[stage] = self.totals.get(stage, 0) + ns
+        if ns > self.maxima.get(stage, 0):
+            self.maxima[stage] = ns
+        if self.sample_every and count % self.sample_every == 1 % self.sample_every:
+            self._emit({'event': 'stage', 'run': self.run, 'stage': stage, 'n': count, 'row': row, 'us': round(ns / 1e3, 1)})
+        if time.perf_counter() >= self.next_summary:
+            self.summary()
+
+    def summary(self, final=False):
+        now = time.perf_counter()
+        self.next_summary = now + self.summary_seconds
+        elapsed = now - self.started
+        event = {
+            'event': 'summary',
+            'run': self.run,
+            'final': final,
+            'rows': self.rows,
+            'elapsed_s': round(elapsed, 3),
+            'rows_per_s': round(self.rows / elapsed, 1) if elapsed else None,
+            'stages': {stage: {
+                'count': count,
+                'total_ms': round(self.totals[stage] / 1e6, 3),
+                'mean_us': round(self.totals[stage] / count / 1e3, 1),
+                'max_us': round(self.maxima[stage] / 1e3, 1),
+            } for stage, count in self.counts.items()},
+        }
+        for name, read in self.gauges.items():
+            event[name] = read()
+        self._emit(event)
+        return event
+
+    def close(self):
+        return self.summary(final=True)
+
+    def _emit(self, event):
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(event, separators=(',', ':')))
+
+
+class NullMetrics:
+    # Stands in where nothing is measured, e.g. inside pool worker processes
+    def timed(self, stage, row=None):
+        return nullcontext()
+
+    def record(self, stage, ns, row=None):
+        pass
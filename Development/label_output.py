@@ -0,0 +1,62 @@
+import os
+import time
+import tempfile
+
+# Where finished label PDFs go. Every run writes into its own directory and every row
+# gets a name no other row can produce, so parallel workers and overlapping runs never
+# share a path. Files are written under a temporary name and renamed into place, so
+# the printer never picks up half a PDF.
+
+# Characters that can't go in a file name on macOS or Linux, swapped in one translate() pass
+UNSAFE_CHARACTERS = str.maketrans({character: '_' for character in '\\/:\x00'})
+
+
+def run_directory(root="."):
+    # e.g. ./labels_20240117-093012_k2j4x9; mkdtemp makes sure no other run gets the same one
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return tempfile.mkdtemp(prefix=f"labels_{stamp}_", dir=root)
+
+
+def safe_name(text):
+    return text.translate(UNSAFE_CHARACTERS).strip() or '_'
+
+
+def label_file_name(project, serial, config, row_number=None, extension=".pdf"):
+    # The row number keeps names unique within a run (the same serial can appear with
+    # several configs); the rest is for whoever looks in the folder
+    name = f"{safe_name(project)} - {safe_name(serial)} - {safe_name(config)}{extension}"
+    return f"{row_number:06d} {name}" if row_number is not None else name
+
+
+def batch_file_name(first_row, last_row):
+    return f"Labels {first_row}-{last_row}.pdf"
+
+
+def write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return path
+
+
+def write_unique(directory, name, data):
+    # For files that only live until they are spooled (single labels): name plus a random
+    # suffix, so two runs printing the same label, or the same serial in another phase or
+    # format, never write over a file lpr hasn't read yet
+    stem, extension = os.path.splitext(name)
+    fd, path = tempfile.mkstemp(dir=directory, prefix=f"{stem} ", suffix=extension)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,234 @@
+import math
+import logging
+from functools import lru_cache
+from collections import namedtuple
+from label_fit import fit_size
+
+# Labels rendered straight into the printer's own 1-bit raster and sent as a raw job,
+# skipping the PDF and the CUPS PDF -> raster filter chain. The same compiled
+# LabelTemplate steps that build the PDF are composited into a NumPy boolean array at
+# the printer's resolution (True = a printed dot): QR modules are scaled up with
+# np.repeat, rotations are np.rot90 and rows are packed MSB first with np.packbits,
+# which is what the print head takes. Only the text goes through Pillow/FreeType, once
+# per distinct string. Rotations must be multiples of 90 degrees (all the label formats
+# are). numpy and PIL are imported where they are used, so PDF runs never load them.
+
+# Fonts for the PDF core fonts (Helvetica, Arial): (file, index in a .ttc), first one
+# found wins. Pillow looks bare file names up in the system font directories.
+FONT_FILES = {
+    '': [("Helvetica.ttc", 0), ("Arial.ttf", 0), ("LiberationSans-Regular.ttf", 0), ("DejaVuSans.ttf", 0)],
+    'B': [("Helvetica.ttc", 1), ("Arial Bold.ttf", 0), ("LiberationSans-Bold.ttf", 0), ("DejaVuSans-Bold.ttf", 0)],
+}
+
+# Quarter turns counter-clockwise (np.rot90's k) for the format's IPP orientation-requested
+ORIENTATION_TURNS = {"4": 1, "5": 3, "6": 2}
+
+# Bump whenever the bitmaps change, so raw jobs in the label cache are not reprinted
+RASTER_VERSION = 2
+
+# Distinct strings kept rasterized; projects, phases and configs repeat across a build
+TEXT_CACHE_SIZE = 4096
+
+ESC = b'\x1b'
+SYN = b'\x16'
+
+# A packed 1-bit label: data is height rows of (width + 7) // 8 bytes, leftmost dot in the high bit
+Bitmap = namedtuple('Bitmap', 'width height data')
+
+
+@lru_cache(maxsize=64)
+def load_font(style, pixels):
+    from PIL import ImageFont
+    for file_name, index in FONT_FILES.get(style, FONT_FILES['']):
+        try:
+            return ImageFont.truetype(file_name, pixels, index=index)
+        except OSError:
+            continue
+    logging.warning(f"No Helvetica/Arial font found for style '{style}', using Pillow's built-in font")
+    return ImageFont.load_default(pixels)
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def text_stamp(text, style, pixels):
+    # (dots, x, y): the rendered text as a boolean array and where its baseline origin
+    # sits inside it
+    import numpy as np
+    from PIL import Image, ImageDraw
+    font = load_font(style, pixels)
+    left, top, right, bottom = font.getbbox(text, anchor='ls')
+    if right <= left or bottom <= top:
+        return np.zeros((0, 0), dtype=bool), 0, 0
+    image = Image.new('L', (right - left, bottom - top), 0)
+    ImageDraw.Draw(image).text((-left, -top), text, font=font, fill=255, anchor='ls')
+    return np.asarray(image) >= 128, -left, -top
+
+
+@lru_cache(maxsize=64)
+def module_dots(modules, start, size, dots):
+    # Dots per QR module along one axis. Modules are rarely a whole number of dots, so
+    # each one gets the dots between its rounded edges: the code keeps its exact size
+    # and the modules differ by at most one dot.
+    import numpy as np
+    edges = np.rint((start + np.arange(modules + 1) * (size / modules)) * dots).astype(int)
+    return np.diff(edges)
+
+
+def qr_stamp(matrix, x, y, size, dots):
+    # QR modules scaled up to printer dots
+    import numpy as np
+    modules = np.array(matrix, dtype=bool)
+    rows = module_dots(len(matrix), y, size, dots)
+    columns = module_dots(len(matrix), x, size, dots)
+    return np.repeat(np.repeat(modules, rows, axis=0), columns, axis=1)
+
+
+def rotate_point(x, y, rotation):
+    # Counter-clockwise on the page (y grows downwards), the way fpdf's rotate() turns things
+    if rotation is None:
+        return x, y
+    angle, cx, cy = rotation
+    dx, dy = x - cx, y - cy
+    if angle == 90:
+        return cx + dy, cy - dx
+    if angle == 180:
+        return cx - dx, cy - dy
+    return cx - dy, cy + dx  # 270
+
+
+def turn_origin(x, y, width, height, turns):
+    # Where (x, y) inside a width x height array ends up after np.rot90(array, turns)
+    if turns == 1:
+        return y, width - x
+    if turns == 2:
+        return width - x, height - y
+    if turns == 3:
+        return height - y, x
+    return x, y
+
+
+def blit(page, stamp, left, top):
+    # OR the stamp onto the page with its top left corner at dot (left, top), clipped to the page
+    height, width = stamp.shape
+    page_height, page_width = page.shape
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + width, page_width), min(top + height, page_height)
+    if x0 < x1 and y0 < y1:
+        page[y0:y1, x0:x1] |= stamp[y0 - top:y1 - top, x0 - left:x1 - left]
+
+
+def page_dots(label_format, dpi):
+    # (rows, columns) of printer dots for the label as laid out on the PDF page
+    width, height = label_format.template.label_size()
+    return round(height * dpi / 25.4), round(width * dpi / 25.4)
+
+
+def composite(label_format, fields, qr, dpi, page):
+    # Draw the label into a boolean array of page_dots(), one element per printer dot
+    import numpy as np
+    dots = dpi / 25.4
+    rotation = None
+    turns = 0
+    style = ''
+    pixels = 0
+    for step, args in label_format.template.steps:
+        if step == 'text' or step == 'fit':
+            if step == 'fit':
+                x, y, text, width, family, style, size, min_size = args
+                text = text.format_map(fields)
+                pixels = round(fit_size(text, family, style, size, width, min_size) * dpi / 72)
+                stamp, origin_x, origin_y = text_stamp(text, style, pixels)
+                room = width * dots
+                if stamp.shape[1] > room:
+                    # A substitute font (no Helvetica/Arial here) runs wider than the core font metrics
+                    pixels = max(math.floor(pixels * room / stamp.shape[1]), round(min(min_size, size) * dpi / 72))
+                    stamp, origin_x, origin_y = text_stamp(text, style, pixels)
+            else:
+                x, y, text = args
+                stamp, origin_x, origin_y = text_stamp(text.format_map(fields), style, pixels)
+            if turns:
+                origin_x, origin_y = turn_origin(origin_x, origin_y, stamp.shape[1], stamp.shape[0], turns)
+                stamp = np.rot90(stamp, turns)
+            x, y = rotate_point(x, y, rotation)
+            blit(page, stamp, round(x * dots - origin_x), round(y * dots - origin_y))
+        elif step == 'font':
+            family, style, size = args
+            pixels = round(size * dpi / 72)
+        elif step == 'qr':
+            x, y, size = args
+            stamp = qr_stamp(qr, x, y, size, dots)
+            # The box's top left corner, turned, is one of the stamp's corners after np.rot90
+            corner_x, corner_y = turn_origin(0, 0, stamp.shape[1], stamp.shape[0], turns)
+            x, y = rotate_point(x, y, rotation)
+            blit(page, np.rot90(stamp, turns), round(x * dots) - corner_x, round(y * dots) - corner_y)
+        else:
+            angle, x, y = args
+            angle %= 360
+            if angle % 90:
+                raise ValueError(f"Label format {label_format.name}: raw output only supports rotations by multiples of 90 degrees")
+            rotation = (angle, x or 0, y or 0) if angle else None
+            turns = angle // 90
+
+
+def label_bitmap(label_format, fields, qr, dpi):
+    # Packed bitmap as it goes through the printer: turned like the PDF job would be
+    # (orientation-requested), one row per line of dots across the print head. The
+    # label is drawn through a turned view of the printer-side array, so packing reads
+    # contiguous rows (packing a turned view is ~20x slower).
+    import numpy as np
+    turns = ORIENTATION_TURNS.get(label_format.options.get("orientation-requested"), 0)
+    rows, columns = page_dots(label_format, dpi)
+    bitmap = np.zeros((columns, rows) if turns % 2 else (rows, columns), dtype=bool)
+    composite(label_format, fields, qr, dpi, np.rot90(bitmap, -turns))
+    height, width = bitmap.shape
+    return Bitmap(width, height, np.packbits(bitmap, axis=1).tobytes())
+
+
+def preview_image(bitmap):
+    # A 1-bit PIL image of a bitmap, black on white, e.g. to save as PNG or show on screen
+    from PIL import Image, ImageChops
+    return ImageChops.invert(Image.frombytes('1', (bitmap.width, bitmap.height), bitmap.data))
+
+
+def dymo_job(bitmaps):
+    # DYMO LabelWriter raster commands (LW 400/450 command set): reset, then per label the
+    # bytes per line and one SYN-prefixed line of dots at a time, then form feed
+    import numpy as np
+    out = [ESC + b'@']
+    for bitmap in bitmaps:
+        bytes_per_line = (bitmap.width + 7) // 8
+        if bytes_per_line > 255:
+            raise ValueError(f"Label is {bitmap.width} dots wide, more than a LabelWriter head")
+        lines = np.empty((bitmap.height, bytes_per_line + 1), dtype=np.uint8)
+        lines[:, 0] = SYN[0]
+        lines[:, 1:] = np.frombuffer(bitmap.data, dtype=np.uint8).reshape(bitmap.height, bytes_per_line)
+        out.append(ESC + b'D' + bytes([bytes_per_line]))
+        out.append(lines.tobytes())
+        out.append(ESC + b'E')
+    return b''.join(out)
+
+
+def zpl_job(bitmaps):
+    # Zebra ZPL II: each label one ^GF graphic field in ASCII hex
+    out = []
+    for bitmap in bitmaps:
+        bytes_per_line = (bitmap.width + 7) // 8
+        data = bitmap.data
+        out.append(f"^XA^PW{bitmap.width}^LL{bitmap.height}^FO0,0^GFA,{len(data)},{len(data)},{bytes_per_line},{data.hex().upper()}^FS^XZ\n")
+    return "".join(out).encode('ascii')
+
+
+RawLanguage = namedtuple('RawLanguage', 'dpi extension encode')
+
+# --raw choices: printer resolution, file extension for the job files, encoder
+RAW_LANGUAGES = {
+    'dymo': RawLanguage(300, '.lw', dymo_job),
+    'zpl': RawLanguage(203, '.zpl', zpl_job),
+}
+
+# Job options that make CUPS pass the bytes through untouched (lp -o raw)
+RAW_OPTIONS = {"raw": "true"}
+
+
+def render_raw(label_format, fields, qr, language):
+    raw = RAW_LANGUAGES[language]
+    return raw.encode([label_bitmap(label_format, fields, qr, raw.dpi)])
@@ -0,0 +1,65 @@
+import csv
+
+# Reading label rows out of TSV exports. A 100k row export is the same handful of
+# projects, phases and configs over and over, so those values are cleaned up once per
+# distinct value and every row shares the one string object, instead of each row
+# stripping, copying and holding its own. Rows stay plain tuples: no __dict__, the
+# fields stored inline, and everything downstream already unpacks them.
+
+# '/' would start a new directory in a file name; translate() swaps it in one pass
+SLASH_TABLE = str.maketrans('/', '_')
+
+# Fields are split on tabs and nothing else, like the line.split('\t') the scripts started
+# with: quotes are part of the value (a config of 6" or "Blue" is printed as written)
+TSV_DIALECT = {'dialect': 'excel-tab', 'quoting': csv.QUOTE_NONE}
+
+# Columns whose values repeat from row to row; serials are unique and not worth sharing
+REPEATED_COLUMNS = ('project', 'phase', 'config')
+
+
+def clean_field(text):
+    return text.strip().translate(SLASH_TABLE)
+
+
+def parse_line(line):
+    # One raw TSV line (bytes, as read from a file opened in binary mode) into its fields
+    return next(csv.reader([line.decode('utf-8', 'replace').rstrip('\r\n')], **TSV_DIALECT), [])
+
+
+def header_indexes(header, columns):
+    # Exact column name first, then a column containing the name (e.g. "Serial Number")
+    indexes = []
+    for column in columns:
+        matches = [i for i, name in enumerate(header) if name == column] or [i for i, name in enumerate(header) if column in name]
+        if not matches:
+            raise ValueError(f"TSV header has no '{column}' column: {header}")
+        indexes.append(matches[0])
+    return indexes
+
+
+def read_tsv(filepath, columns, clean=False):
+    # Stream tuples of the given columns, matched by header name. With clean=True the
+    # repeated columns also get '/' replaced, as the -p/-d/-c arguments do.
+    with open(filepath, 'r', newline='') as f:
+        reader = csv.reader(f, **TSV_DIALECT)
+        header = [name.strip().lower() for name in next(reader, [])]
+        indexes = header_indexes(header, columns)
+        last = max(indexes)
+        repeated = [(position, index) for position, (column, index) in enumerate(zip(columns, indexes)) if column in REPEATED_COLUMNS]
+        prepare = clean_field if clean else str.strip
+        shared = {}  # raw field -> cleaned string every row with that value points at
+        for row in reader:
+            if len(row) <= last:
+                if any(field.strip() for field in row):
+                    raise ValueError(f"Line {reader.line_num} has {len(row)} columns, expected {len(header)}")
+                continue  # skip blank lines
+            fields = [row[i].strip() for i in indexes]
+            if not any(fields) and not any(field.strip() for field in row):
+                continue
+            for position, index in repeated:
+                raw = row[index]
+                value = shared.get(raw)
+                if value is None:
+                    value = shared[raw] = prepare(raw)
+                fields[position] = value
+            yield tuple(fields)
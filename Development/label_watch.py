@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import ctypes
+import ctypes.util
+import select
+import hashlib
+import logging
+from label_output import write_atomic
+from label_rows import header_indexes, parse_line
+
+# Follow a TSV that an export keeps appending to (or every *.tsv in a directory) and
+# hand out only the rows that haven't been printed yet. Progress is kept in
+# "<file>.checkpoint": the byte offset just past the last row whose label was sent,
+# plus that row's length and hash, so a restart seeks straight there instead of
+# re-reading the file, and notices when the file was rewritten underneath it.
+
+POLL_INTERVAL = 1.0  # seconds between checks without inotify, and between checkpoint saves
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+# inotify(7) event bits
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+
+
+def row_hash(line):
+    return hashlib.sha1(line).hexdigest()
+
+
+class TsvFollower:
+    # Rows appended to one TSV since its checkpoint
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.checkpoint_path = path + CHECKPOINT_SUFFIX
+        self.done = self.load()  # checkpoint of the last row whose label was sent
+        self.saved = self.done
+        self.read = None  # checkpoint of the last row handed out (may still be waiting to print)
+        self.indexes = None
+        self.inode = None
+        self.position = None  # where reading continues; None until checked against the checkpoint
+        self.row_count = 0
+        self.error = None  # last problem logged, so a bad file isn't reported on every pass
+        self.failed_row = None  # row whose label the spooler gave up on; the file isn't followed past it
+
+    def load(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logging.warning(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            return None
+
+    def save(self):
+        done = self.done
+        if done is not None and done != self.saved:
+            write_atomic(self.checkpoint_path, json.dumps(done).encode())
+            self.saved = done
+
+    def resume(self, f, header_length):
+        # Continue after the last row handed out (or, on startup, the checkpointed row)
+        # if it is still there, byte for byte
+        checkpoint = self.read or self.done
+        if checkpoint is None:
+            return header_length, 0
+        start = checkpoint["offset"] - checkpoint["row_length"]
+        if start >= header_length and checkpoint["offset"] <= os.fstat(f.fileno()).st_size:
+            f.seek(start)
+            if row_hash(f.read(checkpoint["row_length"])) == checkpoint["row_hash"]:
+                return checkpoint["offset"], checkpoint["rows"]
+        logging.warning(f"{self.path} no longer matches its checkpoint (rewritten or truncated), starting from the top")
+        self.done = self.read = None
+        return header_length, 0
+
+    def new_rows(self):
+        # (row_number, row, mark) for each complete row appended since the last call; call
+        # mark(sent) once the row's label has been sent or given up on to move the checkpoint
+        if self.failed_row is not None:
+            return
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self.inode:
+            self.inode = stat.st_ino
+            self.position = None  # replaced (e.g. renamed into place); check it against the checkpoint again
+        elif self.position is None:
+            pass  # header not read yet (empty, still being written or bad): try it again
+        elif stat.st_size == self.position:
+            return  # nothing appended: costs one stat
+        elif stat.st_size < self.position:
+            self.position = None
+        with open(self.path, 'rb') as f:
+            header_line = f.readline()
+            if not header_line.endswith(b'\n'):
+                return  # header still being written
+            if self.position is None:
+                self.indexes = header_indexes([name.strip().lower() for name in parse_line(header_line)], self.columns)
+                self.position, self.row_count = self.resume(f, len(header_line))
+            f.seek(self.position)
+            for line in iter(f.readline, b''):
+                if not line.endswith(b'\n'):
+                    break  # partly written row; picked up on the next pass
+                self.position += len(line)
+                fields = parse_line(line)
+                if not any(field.strip() for field in fields):
+                    continue  # skip blank lines
+                self.row_count += 1
+                if len(fields) <= max(self.indexes):
+                    logging.error(f"{self.path}: row {self.row_count} has {len(fields)} columns, skipping it")
+                    continue
+                self.read = {"offset": self.position, "row_length": len(line), "row_hash": row_hash(line), "rows": self.row_count}
+                yield self.row_count, tuple(fields[i].strip() for i in self.indexes), self.marker(self.read)
+
+    def marker(self, checkpoint):
+        def mark(sent=True):
+            # Spool jobs finish in order (one spool worker), so the latest mark is the furthest row.
+            # A failed label holds the checkpoint just before it, so a restart retries it, and
+            # no further rows of the file are handed out until then.
+            if self.failed_row is not None:
+                return
+            if sent:
+                self.done = checkpoint
+            else:
+                self.failed_row = checkpoint["rows"]
+                logging.error(f"{self.path}: the label for row {self.failed_row} could not be printed; not following the file past it until restart")
+        return mark
+
+
+class ChangeWaiter:
+    # Sleeps until something in a directory changes: inotify on Linux, plain polling elsewhere (macOS)
+    def __init__(self, directory):
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+            if fd >= 0:
+                if libc.inotify_add_watch(fd, os.fsencode(directory), IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO) >= 0:
+                    self.fd = fd
+                else:
+                    os.close(fd)
+        except (AttributeError, OSError):
+            pass  # no inotify in this libc
+        logging.info(f"Watching {directory} with {'inotify' if self.fd is not None else 'polling'}")
+
+    def wait(self, timeout):
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                while os.read(self.fd, 65536):
+                    pass  # drain the events; which file changed doesn't matter
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class TsvWatch:
+    # Follows one TSV, or every *.tsv in a directory including ones that appear later
+    def __init__(self, path, columns, poll_interval=POLL_INTERVAL):
+        self.path = path
+        self.columns = columns
+        self.poll_interval = poll_interval
+        self.followers = {}
+        # Watch the directory even for a single file, so an export that replaces the file is seen too
+        self.waiter = ChangeWaiter(path if os.path.isdir(path) else os.path.dirname(path) or ".")
+
+    def files(self):
+        if os.path.isdir(self.path):
+            return sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.lower().endswith(".tsv"))
+        return [self.path]
+
+    def rows(self):
+        # Never ends: (file, row_number, row, mark) for every new row, checkpoints saved between passes
+        while True:
+            for file_path in self.files():
+                follower = self.followers.get(file_path)
+                if follower is None:
+                    follower = self.followers[file_path] = TsvFollower(file_path, self.columns)
+                try:
+                    for row_number, row, mark in follower.new_rows():
+                        yield file_path, row_number, row, mark
+                except ValueError as e:
+                    if str(e) != follower.error:
+                        logging.error(f"Skipping {file_path}: {e}")
+                    follower.error = str(e)
+            self.save()
+            self.waiter.wait(self.poll_interval)
+
+    def save(self):
+        for follower in self.followers.values():
+            follower.save()
+
+    def close(self):
+        self.save()
+        self.waiter.close()
@@ -0,0 +1,113 @@
+import os
+import json
+import logging
+import shutil
+import threading
+import subprocess
+
+# Ways of getting a finished label file to the printer. Every backend takes the
+# printer and its job options once, then submit()s files; failures raise PrintError.
+
+
+class PrintError(Exception):
+    pass
+
+
+class LprBackend:
+    # Fallback: fork lpr for every job
+    name = "lpr"
+
+    def __init__(self, printer=None, options=None):
+        self.args = ["lpr"]
+        if printer:
+            self.args += ["-P", printer]
+        for key, value in (options or {}).items():
+            self.args += ["-o", f"{key}={value}"]
+
+    def submit(self, file_name, title=None):
+        args = self.args + (["-T", title] if title else []) + [file_name]
+        try:
+            result = subprocess.run(args, capture_output=True, text=True)
+        except OSError as e:
+            raise PrintError(e)
+        if result.returncode != 0:
+            raise PrintError(result.stderr.strip() or f"lpr exited with status {result.returncode}")
+        return None
+
+    def close(self):
+        pass
+
+
+class CupsBackend:
+    # One CUPS/IPP session for the whole run; needs pycups (pip install pycups)
+    name = "cups"
+
+    def __init__(self, printer=None, options=None):
+        import cups
+        self.cups = cups
+        self.connection = cups.Connection()
+        self.printer = printer or self.connection.getDefault()
+        if not self.printer:
+            raise PrintError("No printer given and CUPS has no default printer")
+        printers = self.connection.getPrinters()
+        if self.printer not in printers:
+            raise PrintError(f"CUPS does not know printer {self.printer}")
+        self.options = {key: str(value) for key, value in (options or {}).items()}
+        self.lock = threading.Lock()  # a cups.Connection must not be shared between threads at once
+
+    def submit(self, file_name, title=None):
+        with self.lock:
+            try:
+                return self.connection.printFile(self.printer, file_name, title or os.path.basename(file_name), self.options)
+            except self.cups.IPPError as e:
+                raise PrintError(e)
+
+    def close(self):
+        self.connection = None
+
+
+class FileSinkBackend:
+    # Copies jobs into a directory instead of printing, with a jobs.jsonl record of
+    # what would have been sent; for testing without a label printer
+    name = "file"
+
+    def __init__(self, directory, printer=None, options=None):
+        self.directory = directory
+        self.printer = printer
+        self.options = dict(options or {})
+        self.lock = threading.Lock()
+        self.job_id = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, file_name, title=None):
+        with self.lock:
+            self.job_id += 1
+            job_id = self.job_id
+            target = os.path.join(self.directory, f"{job_id:06d}-{os.path.basename(file_name)}")
+            try:
+                shutil.copyfile(file_name, target)
+            except OSError as e:
+                raise PrintError(e)
+            with open(os.path.join(self.directory, "jobs.jsonl"), "a") as log:
+                log.write(json.dumps({"job": job_id, "file": target, "title": title, "printer": self.printer, "options": self.options}) + "\n")
+        return job_id
+
+    def close(self):
+        pass
+
+
+def open_backend(kind="auto", printer=None, options=None):
+    # kind is "lpr", "cups", "file:DIRECTORY" or "auto" (CUPS when pycups is installed, else lpr)
+    if kind.startswith("file:"):
+        return FileSinkBackend(kind[len("file:"):], printer, options)
+    if kind == "lpr":
+        return LprBackend(printer, options)
+    if kind == "cups":
+        return CupsBackend(printer, options)
+    if kind == "auto":
+        try:
+            return CupsBackend(printer, options)
+        except Exception as e:
+            logging.info(f"CUPS backend unavailable ({e}), falling back to lpr")
+            return LprBackend(printer, options)
+    raise ValueError(f"Unknown printer backend: {kind}")
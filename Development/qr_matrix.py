@@ -0,0 +1,86 @@
+from functools import lru_cache
+
+# qrcode and PIL are imported where they are used: a reprint straight from the
+# label cache never needs them, and they cost ~0.1 s of startup
+
+# Number of distinct payloads kept encoded; configs repeat across a whole build
+QR_CACHE_SIZE = 4096
+
+# Draw QR codes as filled rectangles in the PDF content stream. Set to False to
+# embed a raster image instead (larger files, blurrier when scaled by the driver).
+QR_VECTOR = True
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_matrix(payload):
+    # Boolean module matrix (True = dark) including the 4 module quiet zone,
+    # same settings as qrcode.make so labels look unchanged
+    import qrcode
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+
+def qr_image(matrix):
+    # One pixel per module; fpdf scales it to the QR box on the label
+    from PIL import Image
+    size = len(matrix)
+    img = Image.new('1', (size, size))
+    img.putdata([0 if dark else 255 for row in matrix for dark in row])
+    return img
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_rects(matrix):
+    # Dark modules merged into as few rectangles as possible, in module units:
+    # runs along a row first, then identical runs on consecutive rows stacked
+    rects = []
+    open_rects = {}  # (column, width) -> index in rects of the run on the previous row
+    for y, row in enumerate(matrix):
+        row_rects = {}
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            run = (start, x - start)
+            if run in open_rects:
+                index = open_rects[run]
+                column, top, width, height = rects[index]
+                rects[index] = (column, top, width, height + 1)
+            else:
+                index = len(rects)
+                rects.append((start, y, x - start, 1))
+            row_rects[run] = index
+        open_rects = row_rects
+    return tuple(rects)
+
+
+def draw_qr(pdf, matrix, x, y, size):
+    module = size / len(matrix)
+    pdf.set_fill_color(0)
+    for column, row, width, height in qr_rects(matrix):
+        pdf.rect(x + column * module, y + row * module, width * module, height * module, style='F')
+
+
+def place_qr(pdf, matrix, x, y, size):
+    if QR_VECTOR:
+        draw_qr(pdf, matrix, x, y, size)
+    else:
+        pdf.image(qr_image(matrix), x=x, y=y, w=size, h=size)
+
+
+def qr_cache_hit_rate():
+    info = qr_matrix.cache_info()
+    lookups = info.hits + info.misses
+    return round(info.hits / lookups, 3) if lookups else None
+
+
+def qr_cache_summary():
+    info = qr_matrix.cache_info()
+    hit_rate = qr_cache_hit_rate() or 0
+    return f"QR cache: {info.hits} hits, {info.misses} misses ({hit_rate:.0%} hit rate), {info.currsize} payloads cached"
@@ -0,0 +1,80 @@
+import time
+import queue
+import logging
+import threading
+from printer_backends import LprBackend
+
+# Finished PDFs waiting for the printer; when full, renderers block until a spool worker catches up
+SPOOL_QUEUE_SIZE = 8
+SPOOL_WORKERS = 1  # more than one worker lets jobs reach the printer out of order
+SPOOL_RETRIES = 2
+SPOOL_RETRY_DELAY = 2.0
+
+
+class Spooler:
+    # Background print spooler: renderers submit() finished files and keep rendering
+    # while worker threads drain the bounded queue through a printer backend (lpr by default).
+    def __init__(self, backend=None, workers=SPOOL_WORKERS, max_queue=SPOOL_QUEUE_SIZE,
+                 retries=SPOOL_RETRIES, retry_delay=SPOOL_RETRY_DELAY):
+        self.backend = backend or LprBackend()
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = []
+        self.threads = [threading.Thread(target=self._work, name=f"spooler-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, file_name, done=None):
+        # Blocks while the queue is full, which throttles rendering to the printer's pace.
+        # done(sent), if given, is called from a spool thread once the job is sent or given up on.
+        self.queue.put((file_name, done))
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def close(self):
+        # Wait for everything queued so far to be sent, then stop the workers
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.backend.close()
+        return self.failed
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            file_name, done = job
+            sent = self._send(file_name)
+            with self.lock:
+                if sent:
+                    self.sent += 1
+                else:
+                    self.failed.append(file_name)
+            if done:
+                done(sent)
+
+    def _send(self, file_name):
+        for attempt in range(self.retries + 1):
+            logging.info(f"Sending {file_name} to printer ({self.backend.name})...")
+            try:
+                self.backend.submit(file_name)
+                return True
+            except Exception as e:
+                error = e
+            logging.warning(f"Printing {file_name} failed (attempt {attempt + 1}/{self.retries + 1}): {error}")
+            if attempt < self.retries:
+                time.sleep(self.retry_delay)
+        logging.error(f"Giving up on {file_name}")
+        return False
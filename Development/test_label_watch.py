@@ -0,0 +1,66 @@
+import json
+from label_watch import TsvFollower, CHECKPOINT_SUFFIX
+
+COLUMNS = ('serial', 'project')
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def rows(follower):
+    return [(row_number, row) for row_number, row, mark in follower.new_rows()]
+
+
+def test_empty_file_then_rows(tmp_path):
+    path = str(tmp_path / "a.tsv")
+    write(path, "")
+    follower = TsvFollower(path, COLUMNS)
+    assert rows(follower) == []
+    assert rows(follower) == []
+    write(path, "serial\tproject\nS1\tP1\n")
+    assert rows(follower) == [(1, ('S1', 'P1'))]
+
+
+def test_half_written_header(tmp_path):
+    path = str(tmp_path / "a.tsv")
+    write(path, "serial\tpro")
+    follower = TsvFollower(path, COLUMNS)
+    assert rows(follower) == []
+    assert rows(follower) == []
+    with open(path, 'a') as f:
+        f.write("ject\nS1\tP1\n")
+    assert rows(follower) == [(1, ('S1', 'P1'))]
+
+
+def test_bad_header_is_read_again(tmp_path):
+    path = str(tmp_path / "a.tsv")
+    write(path, "serial\n")
+    follower = TsvFollower(path, COLUMNS)
+    for _ in range(2):
+        try:
+            rows(follower)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("expected the missing column to be reported")
+    write(path, "serial\tproject\nS1\tP1\n")
+    assert rows(follower) == [(1, ('S1', 'P1'))]
+
+
+def test_failed_label_holds_the_checkpoint(tmp_path):
+    path = str(tmp_path / "a.tsv")
+    write(path, "serial\tproject\nS1\tP1\nS2\tP2\nS3\tP3\n")
+    follower = TsvFollower(path, COLUMNS)
+    marks = [mark for row_number, row, mark in follower.new_rows()]
+    marks[0](True)
+    marks[1](False)
+    marks[2](True)
+    follower.save()
+    with open(path, 'a') as f:
+        f.write("S4\tP4\n")
+    assert rows(follower) == []
+    with open(path + CHECKPOINT_SUFFIX) as f:
+        assert json.load(f)["rows"] == 1
+    assert rows(TsvFollower(path, COLUMNS)) == [(2, ('S2', 'P2')), (3, ('S3', 'P3')), (4, ('S4', 'P4'))]
@@ -1,104 +1,192 @@
 #!/usr/local/bin/python3
-import qrcode
-import fpdf
+import os
 import sys
 import logging
+import importlib.util
 import subprocess
 import argparse
+from collections import deque
 
-# Check and install required packages
-def install_packages():
-    try:
-        import qrcode
-        import fpdf
-    except ImportError:
-        packages = ["qrcode[pil]", "fpdf"]
-        subprocess.check_call([sys.executable, "-m", "pip", "install", *packages])
+# Run directories, file names, atomic writes, the TSV reader, the run journal, the QR
+# matrix cache and the label formats are shared with the scripts in Development
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Development"))
+from label_output import run_directory, label_file_name, batch_file_name, write_atomic
+from qr_matrix import qr_matrix, qr_cache_summary
+from label_formats import LABEL_FORMATS
+from label_rows import read_tsv
+from label_journal import open_journal, NullJournal, JOURNAL_SUFFIX
 
-install_packages()
+# qrcode and fpdf are imported where they are used, so --help and argument errors don't pay
+# for them (fpdf alone takes ~0.3 s); here we only check that they are installed
+REQUIRED_PACKAGES = {"qrcode": "qrcode[pil]", "fpdf": "fpdf"}
 
-# Now, import the packages at the top level
-from qrcode import QRCode
-from fpdf import FPDF
+def missing_packages():
+    return [package for module, package in REQUIRED_PACKAGES.items() if importlib.util.find_spec(module) is None]
+
+# Install missing packages; only run for --install-packages, never on import
+def install_packages():
+    packages = missing_packages()
+    if packages:
+        subprocess.check_call([sys.executable, "-m", "pip", "install", *packages])
 
 # Logging setup
 logging.basicConfig(filename='labels.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Constants
-LABEL_FORMAT = (80, 89)  # Regular Label Format, adjusted to match the GUI version
-SCALER = 1.6
+LABEL_FORMAT = LABEL_FORMATS['cd-80x89']  # geometry and fonts are in Development/label_formats.json
+PAGES_PER_JOB = 100  # Labels per PDF document / lpr job
 
-def scaled(n):
-    return n * SCALER
+# Columns a label needs, in the order rows are handed back
+TSV_COLUMNS = ('serial', 'project', 'phase', 'config')
 
 def make_qr(serial):
-    serial_qr_file = "/tmp/qr_serial.png"
-    qr = QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
-    qr.add_data(serial)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    img.save(serial_qr_file)
-    return serial_qr_file
-
-def make_label(serial, project, phase, config, qr_file):
-    file_name = f"{project} - {serial}.pdf"
-    qr_size = scaled(15)
-    project_font_size = scaled(10)
-    other_font_size = scaled(7)
-
-    pdf = FPDF(orientation='L', unit='mm', format=LABEL_FORMAT)
-    pdf.add_page()
-
-    qr_x_center = (LABEL_FORMAT[0] - qr_size) / 2 - 24
-    qr_y_center = (LABEL_FORMAT[1] - qr_size) / 2 + 14
-
-    pdf.rotate(90, qr_x_center, qr_y_center)
-    pdf.image(qr_file, x=qr_x_center, y=qr_y_center, w=qr_size, h=qr_size)
-    pdf.rotate(0)
-
-    text_start_x = qr_y_center + qr_size - 57
-    text_y_start = qr_x_center + 17
-
-    pdf.rotate(90, text_start_x, text_y_start)
-    pdf.set_font('Arial', 'B', project_font_size)
-    pdf.text(x=text_start_x, y=text_y_start - 3, txt=serial)
-
-    pdf.set_font('Arial', '', other_font_size)
-    pdf.text(x=text_start_x, y=text_y_start + 2, txt=f"{config}")
-    pdf.text(x=text_start_x, y=text_y_start + 6, txt=f"{phase}")
-    pdf.text(x=text_start_x, y=text_y_start + 10, txt=f"{project}")
-    pdf.rotate(0)
-
-    pdf.output(file_name, "F")
-    return file_name
-
-def generate_labels(filepath):
+    # Encoded once per distinct payload and shared through the QR matrix cache
+    return qr_matrix(serial)
+
+def new_label_pdf():
+    return LABEL_FORMAT.new_pdf()
+
+def add_label(pdf, serial, project, phase, config, qr):
+    LABEL_FORMAT.render(pdf, {'serial': serial, 'project': project, 'phase': phase, 'config': config}, qr)
+
+def make_label(serial, project, phase, config, qr, directory=None):
+    file_name = os.path.join(directory or run_directory(), label_file_name(project, serial, config))
+    pdf = new_label_pdf()
+    add_label(pdf, serial, project, phase, config, qr)
+    return write_atomic(file_name, bytes(pdf.output()))
+
+def spool_batch(pdf_bytes, rows, directory, journal=NullJournal()):
+    # rows are the (row_number, row) pairs on the PDF's pages; returns whether lpr took the job
+    file_name = write_atomic(os.path.join(directory, batch_file_name(rows[0][0], rows[-1][0])), pdf_bytes)
+    for row_number, row in rows:
+        journal.record_rendered(row_number, row, file_name)
+    logging.info(f"Sending {file_name} ({len(rows)} labels) to printer...")
+    sent = subprocess.run(["lpr", file_name]).returncode == 0
+    if not sent:
+        logging.error(f"lpr could not print {file_name}")
+    done = journal.marker(rows)
+    if done:
+        done(sent)
+    return sent
+
+# Stream label rows from a TSV file with label_rows.read_tsv ('/' in project, phase and config becomes '_')
+def read_rows(filepath):
+    return read_tsv(filepath, TSV_COLUMNS, clean=True)
+
+def read_batches(rows, pages_per_job):
+    # Group (row_number, row) pairs into chunks of pages_per_job labels
+    batch = []
+    for numbered_row in rows:
+        batch.append(numbered_row)
+        if len(batch) >= pages_per_job:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def unfinished_rows(filepath, journal):
+    # (row_number, row) for every TSV row an earlier run of the journal hasn't printed
+    for row_number, row in enumerate(read_rows(filepath), start=1):
+        if not journal.done(row_number, row):
+            yield row_number, row
+
+def check_fields(*fields):
+    # The core fonts only cover Latin-1, and fpdf only finds out once the page is half drawn;
+    # check first so a bad row never leaves a partial label in the batch
+    for field in fields:
+        field.encode('latin-1')
+
+def render_batch(rows):
+    # Lay out a chunk of (row_number, row) pairs as pages of one PDF; also runs in worker
+    # processes with --workers, so failures carry the error message rather than the exception
+    pdf = new_label_pdf()
+    failures = []
+    for row_number, (serial, project, phase, config) in rows:
+        try:
+            logging.info(f"Generating label for Serial: {serial}, Project: {project}, Phase: {phase}, Config: {config}")
+            check_fields(serial, project, phase, config)
+            add_label(pdf, serial, project, phase, config, make_qr(serial))
+        except Exception as e:
+            failures.append((row_number, serial, str(e)))
+    pdf_bytes = bytes(pdf.output()) if len(failures) < len(rows) else None
+    return pdf_bytes, failures
+
+def rendered_batches(batches, workers):
+    # Yield (rows, future) in TSV row order, keeping a bounded number of chunks in flight
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for rows in batches:
+            pending.append((rows, pool.submit(render_batch, rows)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+def generate_labels(filepath, pages_per_job=PAGES_PER_JOB, workers=1, resume=False):
+    journal = NullJournal()
     try:
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
-            for line in lines[1:]:
-                serial, project, phase, config = line.strip().split('\t')
-                serial = serial.strip()
-                project = project.strip().replace('/', '_')
-                phase = phase.strip().replace('/', '_')
-                config = config.strip().replace('/', '_')
-
-                logging.info(f"Generating label for Serial: {serial}, Project: {project}, Phase: {phase}, Config: {config}")
-                qr_file = make_qr(serial)
-                label_file = make_label(serial, project, phase, config, qr_file)
-
-                logging.info(f"Sending {label_file} to printer...")
-                subprocess.run(["lpr", label_file])
-
-        logging.info("All labels generated successfully.")
+        # Every chunk is journalled in "<file>.journal", so a run that dies halfway (lpr
+        # failing, the machine sleeping) goes on with --resume instead of starting over
+        journal = open_journal(filepath + JOURNAL_SUFFIX, {"script": "CD_Label_Maker", "format": LABEL_FORMAT.layout_id}, resume)
+        if journal.directory and os.path.isdir(journal.directory):
+            directory = journal.directory  # resumed: the rest of the labels join the ones already there
+        else:
+            directory = run_directory()
+        journal.start(directory)
+        logging.info(f"Writing labels to {directory}")
+
+        # Lay out rows as pages of shared PDFs, one lpr job per chunk of pages
+        batches = read_batches(unfinished_rows(filepath, journal), pages_per_job)
+        if workers > 1:
+            results = ((rows, future.result()) for rows, future in rendered_batches(batches, workers))
+        else:
+            results = ((rows, render_batch(rows)) for rows in batches)
+
+        failed = 0
+        for rows, (pdf_bytes, failures) in results:
+            for row_number, serial, e in failures:
+                logging.error(f"Row {row_number} (Serial: {serial}) failed: {e}")
+            failed += len(failures)
+            if pdf_bytes is not None:
+                failed_rows = {row_number for row_number, _, _ in failures}
+                printed = [(row_number, row) for row_number, row in rows if row_number not in failed_rows]
+                if not spool_batch(pdf_bytes, printed, directory, journal):
+                    failed += len(printed)
+
+        if journal.skipped:
+            logging.info(f"Resumed: skipped {journal.skipped} rows that were already printed")
+        if workers == 1:
+            logging.info(qr_cache_summary())
+        if failed:
+            logging.error(f"{failed} labels could not be printed; run again with --resume to retry them.")
+        else:
+            logging.info("All labels generated successfully.")
     except Exception as e:
         logging.error(f"An error occurred: {e}")
+        if not isinstance(journal, NullJournal):
+            logging.error("The labels already sent are in the journal; run again with --resume to print the rest.")
+    finally:
+        journal.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate labels from TSV file.")
-    parser.add_argument('filepath', type=str, help='The file path to the TSV input file.')
+    parser.add_argument('filepath', type=str, nargs='?', help='The file path to the TSV input file.')
+    parser.add_argument('--pages-per-job', type=int, default=PAGES_PER_JOB, help='Number of labels per PDF / print job (1 prints each label separately).')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes rendering labels in parallel.')
+    parser.add_argument('--resume', action='store_true', help='Carry on an interrupted run of this file, skipping the labels it already printed.')
+    parser.add_argument('--install-packages', action='store_true', help='pip install qrcode and fpdf if they are missing.')
     args = parser.parse_args()
 
+    if args.install_packages:
+        install_packages()
+    if missing_packages():
+        print("Requires the following packages:")
+        print(f"python3 -m pip install {' '.join(missing_packages())}")
+        sys.exit(1)
+    if not args.filepath:
+        parser.error("the following arguments are required: filepath")
+
     logging.info("Script started.")
-    generate_labels(args.filepath)
+    generate_labels(args.filepath, args.pages_per_job, args.workers, args.resume)
     logging.info("Script finished.")
@@ -1,78 +1,128 @@
 #!/usr/local/bin/python3
 
-import sys, getopt, logging, subprocess
+import os, sys, getopt, logging, subprocess, importlib.util
 from tkinter import Tk, Label, Button, filedialog, messagebox
 
+# The worker thread, progress panel, output helpers, TSV reader, QR matrix cache and label
+# formats are shared with the scripts in Development
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Development"))
+from label_job import LabelJob, ProgressPanel
+from label_output import run_directory, label_file_name, batch_file_name, write_atomic
+from label_rows import read_tsv
+
 # Set up the logging configuration
 logging.basicConfig(filename='labels.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-try:
-    import qrcode
-    import fpdf
-except ImportError:
+# Check the packages are installed without importing them; they load on the first label
+if not all(importlib.util.find_spec(name) for name in ('qrcode', 'fpdf')):
     logging.error("Required modules not found.")
     print("Requires the following packages:")
     print('python3 -m pip install qrcode fpdf')
     sys.exit(1)
 
-def scaled(n):
-    scaler = 1.6
-    return n * scaler
-
-def make_qr(serial):
-    serial_qr_file = "/tmp/qr_serial.png"
-    img = qrcode.make(serial)
-    img.save(serial_qr_file)
-    return serial_qr_file
-
-def make_label(serial, project, phase, config, qr_file):
-    file_name = f"{project} - {serial}.pdf"
-
-    # Determine label format
-    label_format = (80,89)  #Regular Label Format
-    if label_format == (80,89):
-        qr_size = scaled(15)
-        project_font_size = scaled(10)
-        other_font_size = scaled(7)
-    else:
-        label_format = (25,25)
-
-    pdf = fpdf.FPDF(orientation='L', unit='mm', format=label_format)
-    pdf.add_page()
+from qr_matrix import qr_matrix
+from label_formats import LABEL_FORMATS
 
-    # Positioning for rotated QR code and text
-    qr_x_center = (label_format[0] - qr_size) / 2 - 24 # Centering the QR code horizontally
-    qr_y_center = (label_format[1] - qr_size) / 2 + 14 # Centering the QR code vertically
+# The CD label; geometry and fonts are in Development/label_formats.json
+LABEL_FORMAT = LABEL_FORMATS['cd-80x89']
 
-    # Rotate the QR code by 90 degrees
-    pdf.rotate(90, qr_x_center, qr_y_center)
-    pdf.image(
-        qr_file,
-        x=qr_x_center,
-        y=qr_y_center,
-        w=qr_size,
-        h=qr_size,
-    )
-    pdf.rotate(0)  # Reset rotation for the text
-
-    # Positioning for rotated text
-    text_start_x = qr_y_center + qr_size - 57 # Positioning text below the QR code (since it will be rotated)
-    text_y_start = qr_x_center + 17  # Starting Y position of text to the left of the QR code (since it will be rotated)
-
-    # Rotate the text by 90 degrees
-    pdf.rotate(90, text_start_x, text_y_start)
-    pdf.set_font('Arial', 'B', project_font_size)
-    pdf.text(x=text_start_x, y=text_y_start - 3, txt=serial)
+def make_qr(serial):
+    # Encoded once per distinct payload and shared through the QR matrix cache
+    return qr_matrix(serial)
+
+# Columns a label needs, in the order rows are handed back
+TSV_COLUMNS = ('serial', 'project', 'phase', 'config')
+
+# Number of labels laid out as pages of one PDF and sent as one lpr job
+PAGES_PER_JOB = 100
+
+def new_label_pdf():
+    return LABEL_FORMAT.new_pdf()
+
+def add_label(pdf, serial, project, phase, config, qr):
+    LABEL_FORMAT.render(pdf, {'serial': serial, 'project': project, 'phase': phase, 'config': config}, qr)
+
+def make_label(serial, project, phase, config, qr, directory=None):
+    file_name = os.path.join(directory or run_directory(), label_file_name(project, serial, config))
+    pdf = new_label_pdf()
+    add_label(pdf, serial, project, phase, config, qr)
+    return write_atomic(file_name, bytes(pdf.output()))
+
+# Returns the file name if lpr refused the job, None once it is queued
+def spool_batch(pdf, first_row, last_row, directory):
+    file_name = write_atomic(os.path.join(directory, batch_file_name(first_row, last_row)), bytes(pdf.output()))
+    logging.info(f"Sending {file_name} ({last_row - first_row + 1} labels) to printer...")
+    result = subprocess.run(["lpr", file_name])
+    if result.returncode != 0:
+        logging.error(f"lpr failed for {file_name} (exit {result.returncode})")
+        return file_name
+    return None
 
-    pdf.set_font('Arial', '', other_font_size)
-    pdf.text(x=text_start_x, y=text_y_start + 2, txt=f"{config}")
-    pdf.text(x=text_start_x, y=text_y_start + 6, txt=f"{phase}")
-    pdf.text(x=text_start_x, y=text_y_start + 10, txt=f"{project}")
-    pdf.rotate(0)  # Reset rotation
+# Label rows from the TSV, columns matched by header name; read_tsv also swaps '/' for '_'
+# in project, phase and config
+def read_rows(filepath):
+    return read_tsv(filepath, TSV_COLUMNS, clean=True)
+
+
+# Lay out rows as pages of shared PDFs, one lpr job per chunk of pages. progress(rows_done)
+# is called per row; once cancelled (a threading.Event) is set, the labels laid out so far
+# are printed and the rest skipped. Returns the number of rows printed; raises RuntimeError
+# if lpr refused any of the jobs.
+def print_labels(filepath, progress=None, cancelled=None):
+    directory = run_directory()
+    logging.info(f"Writing labels to {directory}")
+    failed = []
+    pdf = None
+    row_number = 0
+    for row_number, (serial, project, phase, config) in enumerate(read_rows(filepath), start=1):
+        if pdf is None:
+            pdf = new_label_pdf()
+            first_row = row_number
+        logging.info(f"Generating label for Serial: {serial}, Project: {project}, Phase: {phase}, Config: {config}")
+        add_label(pdf, serial, project, phase, config, make_qr(serial))
+        if row_number - first_row + 1 >= PAGES_PER_JOB:
+            failed.append(spool_batch(pdf, first_row, row_number, directory))
+            pdf = None
+        if progress:
+            progress(row_number)
+        if cancelled and cancelled.is_set():
+            logging.info(f"Cancelled after {row_number} rows")
+            break
+    if pdf is not None:
+        failed.append(spool_batch(pdf, first_row, row_number, directory))
+    failed = [file_name for file_name in failed if file_name]
+    if failed:
+        raise RuntimeError(f"Could not print {', '.join(failed)}")
+    return row_number
+
+# Runs on the worker thread (see label_job); returns (labels printed, whether it was
+# cancelled). The progress bar's total is counted alongside, not before the first label.
+def run_labels(job, filepath):
+    job.count_in_background(filepath)
+    printed = print_labels(filepath, job.progress, job.cancelled)
+    return printed, job.cancelled.is_set()
+
+# Called back on the Tk thread when the worker finishes
+def labels_done(result):
+    printed, cancelled = result
+    set_running(False)
+    if cancelled:
+        logging.info(f"Stopped after {printed} labels.")
+        messagebox.showinfo("Cancelled", f"Stopped after {printed} labels.")
+    else:
+        logging.info("All labels generated successfully.")
+        messagebox.showinfo("Success", "Labels generated successfully!")
 
-    pdf.output(file_name, "F")
-    return file_name
+def labels_failed(e):
+    set_running(False)
+    logging.error(f"An error occurred: {e}")
+    messagebox.showerror("Error", f"An error occurred: {e}")
 
+def set_running(running):
+    # Keep a second batch from being started while one is running
+    state = 'disabled' if running else 'normal'
+    browse_btn.config(state=state)
+    generate_btn.config(state=state)
 
 def browse_files():
     logging.info("Browsing for TSV files...")
@@ -91,29 +141,9 @@ def generate_labels():
         messagebox.showerror("Error", "Please select a valid TSV file.")
         return
 
-    try:
-        logging.info(f"Reading from file: {filepath}")
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
-            for line in lines[1:]:  # skipping header
-                serial, project, phase, config = line.strip().split('\t')
-                serial = serial.strip()
-                project = project.strip().replace('/', '_')
-                phase = phase.strip().replace('/', '_')
-                config = config.strip().replace('/', '_')
-
-                logging.info(f"Generating label for Serial: {serial}, Project: {project}, Phase: {phase}, Config: {config}")
-                qr_file = make_qr(serial)
-                label_file = make_label(serial, project, phase, config, qr_file)
-
-                logging.info(f"Sending {label_file} to printer...")
-                subprocess.run(["lpr", label_file])
-
-        logging.info("All labels generated successfully.")
-        messagebox.showinfo("Success", "Labels generated successfully!")
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
-        messagebox.showerror("Error", f"An error occurred: {e}")
+    logging.info(f"Reading from file: {filepath}")
+    set_running(True)
+    progress_panel.run(LabelJob(run_labels, filepath), labels_done, labels_failed)
 
 # GUI setup
 root = Tk()
@@ -131,6 +161,9 @@ file_label.pack(pady=10)
 generate_btn = Button(root, text="Generate Labels", command=generate_labels)
 generate_btn.pack(pady=20)
 
+progress_panel = ProgressPanel(root)
+progress_panel.pack(pady=10)
+
 if __name__ == "__main__":
     logging.info("Script started.")
     root.mainloop()
@@ -1,8 +1,12 @@
 #!/usr/local/bin/python3
 
-import sys, getopt, logging, subprocess
+import os, sys, getopt, logging, subprocess
 from tkinter import Tk, Label, Button, filedialog, messagebox, Radiobutton, StringVar
 
+# Run directories and atomic label files come from Development/label_output.py, shared with the scripts there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Development"))
+from label_output import run_directory, label_file_name, write_atomic
+
 # Set up the logging configuration
 logging.basicConfig(filename='labels.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -23,14 +27,12 @@ def scaled(size, label_format):
 
 # Function to create QR code image file
 def make_qr(config):
-    serial_qr_file = "/tmp/qr_serial.png"
-    img = qrcode.make(config)
-    img.save(serial_qr_file)
-    return serial_qr_file
+    # Keep the QR in memory; fpdf embeds PIL images directly
+    return qrcode.make(config).get_image()
 
-# Function to generate PDF label
-def make_label(serial, project, phase, config, qr_file, product_type='iPhone'):
-    file_name = f"{project} - {serial}.pdf"
+# Function to generate PDF label; the row number keeps names unique within a run directory
+def make_label(serial, project, phase, config, qr_img, product_type='iPhone', directory=None, row_number=None):
+    file_name = os.path.join(directory or run_directory(), label_file_name(project, serial, config, row_number))
 
     # Define label formats for different products
     iphone_label_format = (80, 89)
@@ -57,7 +59,7 @@ def make_label(serial, project, phase, config, qr_file, product_type='iPhone'):
         qr_x_center = (label_format[0] - qr_size) / 2 - 24
         qr_y_center = (label_format[1] - qr_size) / 2 + 14
         pdf.rotate(90, qr_x_center, qr_y_center)
-        pdf.image(qr_file, x=qr_x_center, y=qr_y_center, w=qr_size, h=qr_size)
+        pdf.image(qr_img, x=qr_x_center, y=qr_y_center, w=qr_size, h=qr_size)
         pdf.rotate(0)  # Reset rotation for text
         text_start_x = qr_y_center + qr_size - 57
         text_y_start = qr_x_center + 17
@@ -71,7 +73,7 @@ def make_label(serial, project, phase, config, qr_file, product_type='iPhone'):
     else:
         qr_x = (label_format[0] - qr_size) / 2
         qr_y = -1
-        pdf.image(qr_file, x=qr_x, y=qr_y, w=qr_size, h=qr_size)
+        pdf.image(qr_img, x=qr_x, y=qr_y, w=qr_size, h=qr_size)
         text_y_start = qr_y + qr_size + 1.5  # Adjust text start position below QR code
         pdf.set_font('Arial', 'B', project_font_size)
         pdf.text(2, text_y_start, f" {serial}")
@@ -80,8 +82,7 @@ def make_label(serial, project, phase, config, qr_file, product_type='iPhone'):
         pdf.text(2, text_y_start + 6, f"{phase}")
         pdf.text(2, text_y_start + 9, project)
 
-    pdf.output(file_name, "F")
-    return file_name
+    return write_atomic(file_name, bytes(pdf.output()))
 
 # Function to open file dialog and select CSV file
 def browse_files():
@@ -99,10 +100,12 @@ def generate_labels(filename, product_type='iPhone'):
         with open(filename, 'r') as file:
             lines = file.readlines()
 
-        for line in lines[1:]:  # skipping header
+        directory = run_directory()
+        logging.info(f"Writing labels to {directory}")
+        for row_number, line in enumerate(lines[1:], start=1):  # skipping header
             project, phase, config, serial = line.strip().split(',')
-            qr_file = make_qr(serial)
-            label_file = make_label(serial, project, phase, config, qr_file, product_type)
+            qr_img = make_qr(serial)
+            label_file = make_label(serial, project, phase, config, qr_img, product_type, directory, row_number)
             logging.info(f"Generated label: {label_file}")
 
             # Send label to printer